@@ -0,0 +1,187 @@
+"""Run one context against a file of prompts through a bounded pool of workers."""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from db_manager import DatabaseManager, ChatMessage, Context
+from openai_client import OpenAIWrapper, usage_fields
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchProgress:
+    total: int
+    skipped: int = 0
+    completed: int = 0
+    failed: int = 0
+    started_at: float = 0.0
+
+    @property
+    def pending(self) -> int:
+        return self.total - self.skipped - self.completed - self.failed
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        elapsed = self.elapsed
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+
+def load_prompts(path: str) -> List[str]:
+    """Read prompts from a text file (one per line) or a JSONL file.
+
+    JSONL lines may be plain strings or objects with a ``prompt`` field.
+    """
+    prompts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if path.endswith(".jsonl"):
+                record = json.loads(line)
+                line = record["prompt"] if isinstance(record, dict) else str(record)
+            prompts.append(line)
+    return prompts
+
+
+def batch_key_for(path: str, context: Optional[Context]) -> str:
+    source = f"{Path(path).resolve()}\0{context.name if context else ''}"
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+
+
+def _prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class BatchRunner:
+    def __init__(
+        self,
+        api_client: OpenAIWrapper,
+        db: DatabaseManager,
+        context: Optional[Context] = None,
+        concurrency: int = 8,
+        flush_size: int = 50,
+        flush_interval: float = 2.0,
+        on_progress: Optional[Callable[[BatchProgress], None]] = None,
+    ):
+        self.api_client = api_client
+        self.db = db
+        self.context = context
+        self.concurrency = max(1, concurrency)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.on_progress = on_progress
+        self.batch_key = ""
+        self._results: List[Tuple[int, str, ChatMessage]] = []
+        self._last_flush = 0.0
+
+    async def run(self, prompts: List[str], batch_key: str) -> BatchProgress:
+        """Send every prompt not already completed under ``batch_key``.
+
+        Results are committed in groups, so an interrupted run loses at most
+        the last unflushed group and a rerun with the same key resumes.
+        """
+        self.batch_key = batch_key
+        context_id = self.context.id if self.context else None
+        thread_id = self.db.get_batch_thread(batch_key, context_id)
+        completed = self.db.get_completed_batch_items(batch_key)
+
+        progress = BatchProgress(total=len(prompts), started_at=time.monotonic())
+        queue: asyncio.Queue = asyncio.Queue()
+        for index, prompt in enumerate(prompts):
+            prompt_hash = _prompt_hash(prompt)
+            if (index, prompt_hash) in completed:
+                progress.skipped += 1
+            else:
+                queue.put_nowait((index, prompt_hash, prompt))
+
+        self._last_flush = time.monotonic()
+        workers = [
+            asyncio.create_task(self._worker(queue, thread_id, progress))
+            for _ in range(min(self.concurrency, queue.qsize()))
+        ]
+        reporter = asyncio.create_task(self._report(progress))
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            reporter.cancel()
+            self._flush()
+            self._notify(progress)
+        return progress
+
+    async def _worker(
+        self, queue: asyncio.Queue, thread_id: float, progress: BatchProgress
+    ) -> None:
+        while True:
+            try:
+                index, prompt_hash, prompt = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            try:
+                response = await self.api_client.send_message(
+                    [{"role": "user", "content": prompt}],
+                    context=self.context.content if self.context else "",
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Batch item {index} failed: {e}")
+                progress.failed += 1
+                continue
+
+            self._results.append(
+                (
+                    index,
+                    prompt_hash,
+                    ChatMessage(
+                        id=None,
+                        user_message=prompt,
+                        assistant_message=response.choices[0].message.content or "",
+                        context_id=self.context.id if self.context else None,
+                        timestamp=datetime.now(),
+                        thread_id=thread_id,
+                        model=response.model,
+                        **usage_fields(response.usage),
+                    ),
+                )
+            )
+            progress.completed += 1
+            if (
+                len(self._results) >= self.flush_size
+                or time.monotonic() - self._last_flush >= self.flush_interval
+            ):
+                self._flush()
+
+    def _flush(self) -> None:
+        results, self._results = self._results, []
+        self._last_flush = time.monotonic()
+        if results:
+            self.db.add_batch_results(
+                self.batch_key,
+                results,
+                context_content=self.context.content if self.context else None,
+            )
+
+    async def _report(self, progress: BatchProgress) -> None:
+        while True:
+            await asyncio.sleep(1.0)
+            self._notify(progress)
+
+    def _notify(self, progress: BatchProgress) -> None:
+        if self.on_progress:
+            self.on_progress(progress)
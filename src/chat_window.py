@@ -9,18 +9,44 @@ from PyQt6.QtWidgets import (
     QProgressBar,
     QLabel,
     QSplitter,
+    QMessageBox,
+    QListWidget,
+    QListWidgetItem,
 )
-from PyQt6.QtCore import Qt, pyqtSignal, pyqtSlot
+from PyQt6.QtCore import Qt, pyqtSignal
 from PyQt6.QtGui import QTextCursor, QKeySequence, QShortcut
 import asyncio
-import asyncio.events
-from typing import Optional
-from datetime import datetime
-import markdown2
-
-from openai_client import OpenAIWrapper
-from db_manager import DatabaseManager, ChatMessage
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Set, Tuple
+from datetime import datetime, date
+
+from db_manager import (
+    DatabaseManager,
+    ChatMessage,
+    OutboundItem,
+    DONE,
+    FAILED,
+    IN_FLIGHT,
+    QUEUED,
+)
 from config import AppConfig
+from diagnostics import trace
+from outbound import OutboundQueue, REMOVED
+from render import MarkdownRenderer
+
+logger = logging.getLogger(__name__)
+
+# Identical input re-sent within this many seconds is treated as an accidental double send.
+DUPLICATE_SEND_WINDOW = 2.0
+
+QUEUE_STATE_LABELS = {
+    QUEUED: "Queued",
+    IN_FLIGHT: "Sending",
+    DONE: "Sent",
+    FAILED: "Failed",
+}
 
 
 class ChatWindow(QMainWindow):
@@ -28,16 +54,24 @@ class ChatWindow(QMainWindow):
 
     def __init__(
         self,
-        api_client: OpenAIWrapper,
+        outbound: OutboundQueue,
         db: DatabaseManager,
         config: AppConfig,
+        renderer: MarkdownRenderer,
         parent: Optional[QWidget] = None,
     ):
         super().__init__(parent)
-        self.api_client = api_client
+        self.outbound = outbound
         self.db = db
         self.config = config
-        self._sending = False
+        self.renderer = renderer
+        self.current_thread_id = datetime.now().timestamp()
+        # Keyed by database and id, as ids repeat after database_path changes
+        self._queue_items: Dict[Tuple[str, int], QListWidgetItem] = {}
+        self._last_send: Optional[tuple] = None
+        self._soft_budget_acknowledged: Optional[str] = None
+        self._rendered_contexts: Set[str] = set()
+        self._pending_replies: Deque[Tuple[ChatMessage, asyncio.Future]] = deque()
 
         self.setup_ui()
         self.load_contexts()
@@ -88,6 +122,16 @@ class ChatWindow(QMainWindow):
         """
         )
         splitter.addWidget(self.chat_history)
+
+        # Outbound queue for this thread
+        self.queue_list = QListWidget()
+        self.queue_list.setToolTip(
+            "Double-click a failed message to retry it, press Delete to remove a waiting one"
+        )
+        self.queue_list.itemDoubleClicked.connect(self.retry_queue_item)
+        self.queue_list.setVisible(False)
+        splitter.addWidget(self.queue_list)
+        splitter.setSizes([500, 80])
         layout.addWidget(splitter)
 
         # Input area
@@ -118,8 +162,13 @@ class ChatWindow(QMainWindow):
         """
         )
         self.send_button.clicked.connect(self.handle_send_message)
+        self.stop_button = QPushButton("Stop")
+        self.stop_button.setStyleSheet(self.send_button.styleSheet())
+        self.stop_button.setVisible(False)
+        self.stop_button.clicked.connect(self.cancel_send)
         input_layout.addWidget(self.input_field)
         input_layout.addWidget(self.send_button)
+        input_layout.addWidget(self.stop_button)
         layout.addLayout(input_layout)
 
         # Progress bar
@@ -143,76 +192,217 @@ class ChatWindow(QMainWindow):
         clear_shortcut = QShortcut(QKeySequence("Ctrl+L"), self)
         clear_shortcut.activated.connect(self.clear_chat)
 
-    def handle_send_message(self) -> None:
-        """Handle the send message action by running the coroutine."""
-        if self._sending:
-            self.logger.warning("Message send in progress, please wait...")
-            return
+        cancel_shortcut = QShortcut(QKeySequence("Esc"), self)
+        cancel_shortcut.activated.connect(self.cancel_send)
 
-        self._sending = True
-        asyncio.create_task(self._send_message_wrapper())
+        remove_shortcut = QShortcut(QKeySequence("Delete"), self.queue_list)
+        remove_shortcut.activated.connect(self.remove_queue_item)
 
-    @pyqtSlot()
-    async def _send_message_wrapper(self) -> None:
-        try:
-            await self.send_message()
-        finally:
-            self._sending = False
+    def handle_send_message(self) -> None:
+        """Handle the send message action by queueing the prompt."""
+        if not self.check_token_budget():
+            return
 
-    async def send_message(self) -> None:
+        current_context = self.context_combo.currentData()
+        send_key = (
+            self.input_field.toPlainText().strip(),
+            current_context.id if current_context else None,
+        )
+        if (
+            self._last_send
+            and self._last_send[0] == send_key
+            and time.monotonic() - self._last_send[1] < DUPLICATE_SEND_WINDOW
+        ):
+            logger.info("Ignoring duplicate send of the same message")
+            return
+        self._last_send = (send_key, time.monotonic())
+        self.send_message()
+
+    def check_token_budget(self) -> bool:
+        """Warn once a day past the soft budget and refuse to send past the hard one."""
+        soft_budget = self.config.daily_token_soft_budget
+        hard_budget = self.config.daily_token_hard_budget
+        if not soft_budget and not hard_budget:
+            return True
+
+        today = date.today().isoformat()
+        used = self.db.get_daily_token_total(today)
+        if hard_budget and used >= hard_budget:
+            QMessageBox.warning(
+                self,
+                "Token Budget Reached",
+                f"{used:,} of today's {hard_budget:,} token budget used. "
+                "Sending is blocked until tomorrow or until the budget is raised.",
+            )
+            return False
+        if (
+            soft_budget
+            and used >= soft_budget
+            and self._soft_budget_acknowledged != today
+        ):
+            reply = QMessageBox.question(
+                self,
+                "Token Budget Warning",
+                f"{used:,} tokens used today, past the {soft_budget:,} token "
+                "soft budget. Send anyway?",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+            )
+            if reply != QMessageBox.StandardButton.Yes:
+                return False
+            self._soft_budget_acknowledged = today
+        return True
+
+    def cancel_send(self) -> None:
+        for list_item in self._queue_items.values():
+            item = list_item.data(Qt.ItemDataRole.UserRole)
+            if item.state == IN_FLIGHT:
+                self.outbound.cancel(item.id)
+
+    @trace("send_message")
+    def send_message(self) -> None:
         message = self.input_field.toPlainText().strip()
         if not message:
             return
 
+        # Stored before it is sent, so a dropped connection no longer loses it
         self.input_field.clear()
-        self.progress_bar.setVisible(True)
+        self.outbound.enqueue(
+            self.current_thread_id, message, self.context_combo.currentData()
+        )
 
-        try:
-            current_context = self.context_combo.currentData()
-            response = await self.api_client.send_message(
-                [{"role": "user", "content": message}],
-                context=current_context.content if current_context else "",
-            )
+    def handle_outbound_change(
+        self, item: OutboundItem, message: Optional[ChatMessage]
+    ) -> None:
+        if item.thread_id != self.current_thread_id:
+            return
 
-            thread_id = None
-            if not hasattr(self, "current_thread_id"):
-                self.current_thread_id = datetime.now().timestamp()
-            thread_id = self.current_thread_id
-
-            self.db.add_message(
-                ChatMessage(
-                    id=None,
-                    user_message=message,
-                    assistant_message=response.choices[0].message.content,
-                    context_id=current_context.id if current_context else "",
-                    timestamp=datetime.now(),
-                    thread_id=thread_id,
-                )
+        if item.state == REMOVED:
+            list_item = self._queue_items.pop((item.db_path, item.id), None)
+            if list_item:
+                self.queue_list.takeItem(self.queue_list.row(list_item))
+            if not self.input_field.toPlainText().strip():
+                # Nothing came back, so give the prompt back instead of dropping it
+                self.input_field.setPlainText(item.user_message)
+        else:
+            list_item = self._queue_items.get((item.db_path, item.id))
+            if list_item is None:
+                list_item = QListWidgetItem()
+                self._queue_items[(item.db_path, item.id)] = list_item
+                self.queue_list.addItem(list_item)
+            self.update_queue_item(list_item, item)
+            self.queue_list.scrollToItem(list_item)
+
+        # Waiting items change label with connectivity, not only their own state
+        for other in self._queue_items.values():
+            waiting = other.data(Qt.ItemDataRole.UserRole)
+            if waiting.state == QUEUED:
+                self.update_queue_item(other, waiting)
+        self.update_queue_visibility()
+
+        if item.state == DONE and message:
+            self.queue_reply(message)
+
+    def clear_queue(self) -> None:
+        """Drop entries from other databases, which the queue no longer acts on.
+
+        Items in flight stay listed, since they still finish and can be stopped.
+        """
+        for key, list_item in list(self._queue_items.items()):
+            item = list_item.data(Qt.ItemDataRole.UserRole)
+            if item.db_path != self.db.db_path and item.state != IN_FLIGHT:
+                del self._queue_items[key]
+                self.queue_list.takeItem(self.queue_list.row(list_item))
+        self.update_queue_visibility()
+
+    def update_queue_visibility(self) -> None:
+        states = [
+            list_item.data(Qt.ItemDataRole.UserRole).state
+            for list_item in self._queue_items.values()
+        ]
+        self.queue_list.setVisible(bool(states))
+        self.progress_bar.setVisible(QUEUED in states or IN_FLIGHT in states)
+        self.stop_button.setVisible(IN_FLIGHT in states)
+
+    def update_queue_item(self, list_item: QListWidgetItem, item: OutboundItem) -> None:
+        label = QUEUE_STATE_LABELS[item.state]
+        if item.state == QUEUED and item.next_attempt_at > time.time():
+            label = (
+                f"Retrying at {datetime.fromtimestamp(item.next_attempt_at):%H:%M:%S}"
             )
+        elif item.state == QUEUED and not self.outbound.online:
+            label = "Waiting for connection"
+        title = " ".join(item.user_message.split())[:60]
+        list_item.setText(f"[{label}] {title}")
+        list_item.setToolTip(item.last_error or "")
+        list_item.setData(Qt.ItemDataRole.UserRole, item)
+
+    def retry_queue_item(self, list_item: QListWidgetItem) -> None:
+        self.outbound.retry(list_item.data(Qt.ItemDataRole.UserRole))
+
+    def remove_queue_item(self) -> None:
+        list_item = self.queue_list.currentItem()
+        if list_item:
+            self.outbound.remove(list_item.data(Qt.ItemDataRole.UserRole))
+
+    def queue_reply(self, message: ChatMessage) -> None:
+        # Replies render concurrently but are shown in the order they arrived,
+        # so a short reply does not jump ahead of a long one still rendering
+        render = asyncio.ensure_future(self.renderer.render(message.assistant_message))
+        self._pending_replies.append((message, render))
+        if len(self._pending_replies) == 1:
+            asyncio.ensure_future(self.show_replies())
+
+    async def show_replies(self) -> None:
+        while self._pending_replies:
+            message, render = self._pending_replies[0]
+            html = None
+            try:
+                html = await render
+            except asyncio.CancelledError:
+                if self._pending_replies and self._pending_replies[0][1] is render:
+                    raise
+            except Exception as e:
+                logger.warning(f"Rendering reply failed, rendering inline: {e}")
+            if not self._pending_replies or self._pending_replies[0][1] is not render:
+                # The chat was cleared while the reply rendered
+                return
+            self._pending_replies.popleft()
+            try:
+                self.show_reply(message, html)
+            except Exception as e:
+                logger.error(f"Could not show reply: {e}")
+
+    def show_reply(self, message: ChatMessage, html: Optional[str] = None) -> None:
+        # Show each context version once per thread rather than before every message
+        if message.context_hash and message.context_hash not in self._rendered_contexts:
+            self._rendered_contexts.add(message.context_hash)
+            context = self.db.get_context_version(message.context_hash)
+            if context:
+                self.append_message("Context", context)
+        self.append_message("You", message.user_message)
+        self.append_message(
+            "Assistant",
+            message.assistant_message,
+            truncated=message.truncated,
+            html=html,
+        )
 
-            if current_context:
-                self.append_message("Context", current_context.content)
-            self.append_message("You", message)
-            self.append_message("Assistant", response.choices[0].message.content)
-
-        finally:
-            self.progress_bar.setVisible(False)
-
-    def append_message(self, sender: str, content: str) -> None:
+    @trace("append_message")
+    def append_message(
+        self,
+        sender: str,
+        content: str,
+        truncated: bool = False,
+        html: Optional[str] = None,
+    ) -> None:
         cursor = self.chat_history.textCursor()
         cursor.movePosition(QTextCursor.MoveOperation.End)
 
-        # Convert markdown to HTML for Assistant messages
+        # Convert markdown to HTML for Assistant messages, unless already rendered
         if sender == "Assistant":
-            content = markdown2.markdown(
-                content,
-                extras=[
-                    "fenced-code-blocks",
-                    "tables",
-                    "break-on-newline",
-                    "code-friendly",
-                ],
-            )
+            content = html if html is not None else self.renderer.render_now(content)
+            if truncated:
+                content += "<p><i>[Stopped - response truncated]</i></p>"
 
         # Add styling to different message types
         if sender == "You":
@@ -235,9 +425,19 @@ class ChatWindow(QMainWindow):
         self.chat_history.setTextCursor(cursor)
         self.chat_history.ensureCursorVisible()
 
+    def update_config(self, config: AppConfig, changed: Set[str]) -> None:
+        self.config = config
+        if changed & {"window_width", "window_height"}:
+            self.resize(config.window_width, config.window_height)
+
     def clear_chat(self) -> None:
         self.chat_history.clear()
+        self._rendered_contexts.clear()
+        for _, render in self._pending_replies:
+            render.cancel()
+        self._pending_replies.clear()
 
+    @trace("load_contexts")
     def load_contexts(self) -> None:
         """Load available contexts into the context selector."""
         self.context_combo.clear()
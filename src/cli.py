@@ -0,0 +1,314 @@
+"""Headless command-line client for the chat history and the OpenAI API.
+
+Only the Qt-free modules are imported here, and asyncio and the OpenAI client
+are imported lazily by the commands that talk to the API, so history lookups
+start fast enough to bind to shell aliases.
+"""
+
+import argparse
+import sys
+from datetime import date, datetime, timedelta
+from typing import Awaitable, List, Optional
+
+import diagnostics
+from config import ConfigManager
+from db_manager import DatabaseManager, ChatMessage
+
+SEARCH_TYPES = {
+    "all": "All",
+    "user": "User Messages",
+    "assistant": "Assistant Responses",
+}
+
+
+def _read_prompt(words: List[str]) -> str:
+    if words and words != ["-"]:
+        return " ".join(words)
+    if sys.stdin.isatty():
+        return ""
+    return sys.stdin.read()
+
+
+def _one_line(text: str, width: int = 80) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= width else text[: width - 3] + "..."
+
+
+def _api_client(config, db: DatabaseManager, model: Optional[str] = None):
+    from openai_client import HEDGE_WINDOW, HedgePolicy, OpenAIWrapper
+    from router import ModelRouter
+
+    router = ModelRouter(
+        db,
+        config.auto_fast_model,
+        config.auto_strong_model,
+        config.latency_target_seconds,
+    )
+    hedge = HedgePolicy(
+        config.hedge_enabled,
+        config.hedge_percentile,
+        config.hedge_budget,
+        config.hedge_default_delay,
+        config.hedge_model,
+    )
+    if config.hedge_enabled:
+        hedge.load_history(db.get_recent_hedge_flags(HEDGE_WINDOW))
+    return OpenAIWrapper(
+        config.openai_api_key,
+        model or config.model_name,
+        config.openai_base_url,
+        router=router,
+        hedge=hedge,
+    )
+
+
+async def _ask(args: argparse.Namespace, config, db: DatabaseManager) -> int:
+    import asyncio
+
+    prompt = _read_prompt(args.prompt).strip()
+    if not prompt:
+        print("error: no prompt given", file=sys.stderr)
+        return 2
+
+    context = None
+    if args.context:
+        context = db.get_context_by_name(args.context)
+        if context is None:
+            print(f"error: unknown context '{args.context}'", file=sys.stderr)
+            return 2
+
+    messages = []
+    thread_id = args.thread
+    if thread_id is None:
+        thread_id = datetime.now().timestamp()
+    else:
+        for previous in db.get_messages(
+            thread_id=thread_id, limit=args.history, newest=True
+        ):
+            messages.append({"role": "user", "content": previous.user_message})
+            messages.append(
+                {"role": "assistant", "content": previous.assistant_message}
+            )
+    messages.append({"role": "user", "content": prompt})
+
+    stream = _api_client(config, db, args.model).stream_message(
+        messages, context=context.content if context else ""
+    )
+    truncated = False
+    try:
+        async for text in stream:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+    except asyncio.CancelledError:
+        truncated = True
+        if not stream.content:
+            raise
+    sys.stdout.write("\n")
+
+    db.add_message(
+        ChatMessage(
+            id=None,
+            user_message=prompt,
+            assistant_message=stream.content,
+            context_id=context.id if context else None,
+            timestamp=datetime.now(),
+            thread_id=thread_id,
+            truncated=truncated,
+            model=stream.model,
+            hedge_winner=stream.hedge_winner,
+            **stream.usage_fields(),
+        ),
+        context_content=context.content if context else None,
+    )
+    print(f"thread: {thread_id}", file=sys.stderr)
+    if truncated:
+        raise KeyboardInterrupt
+    return 0
+
+
+async def _batch(args: argparse.Namespace, config, db: DatabaseManager) -> int:
+    from batch import BatchRunner, batch_key_for, load_prompts
+
+    context = None
+    if args.context:
+        context = db.get_context_by_name(args.context)
+        if context is None:
+            print(f"error: unknown context '{args.context}'", file=sys.stderr)
+            return 2
+
+    prompts = load_prompts(args.file)
+    batch_key = args.name or batch_key_for(args.file, context)
+
+    def report(progress) -> None:
+        sys.stderr.write(
+            f"\r{progress.completed + progress.skipped}/{progress.total} done"
+            f"  {progress.failed} failed  {progress.skipped} resumed"
+            f"  {progress.throughput:.1f} req/s  {progress.elapsed:.0f}s"
+        )
+        sys.stderr.flush()
+
+    runner = BatchRunner(
+        _api_client(config, db, args.model),
+        db,
+        context=context,
+        concurrency=args.concurrency,
+        on_progress=report,
+    )
+    progress = await runner.run(prompts, batch_key)
+    sys.stderr.write("\n")
+    print(f"batch: {batch_key}", file=sys.stderr)
+    return 1 if progress.failed else 0
+
+
+def _usage(args: argparse.Namespace, config, db: DatabaseManager) -> int:
+    end = date.today()
+    start = end - timedelta(days=args.days - 1)
+    rows = db.get_usage_report(start.isoformat(), end.isoformat(), by_day=args.daily)
+    print(
+        f"{'day':<22} {'model':<20} {'context':<20} {'requests':>8} "
+        f"{'prompt':>10} {'completion':>10} {'cached':>10}"
+    )
+    for row in rows:
+        print(
+            f"{row.day:<22} {row.model or '-':<20} {row.context_name or '-':<20} "
+            f"{row.requests:>8} {row.prompt_tokens:>10,} {row.completion_tokens:>10,} "
+            f"{row.cached_tokens:>10,}"
+        )
+    total = sum(row.total_tokens for row in rows)
+    print(f"Total: {total:,} tokens over {args.days} days", file=sys.stderr)
+    return 0
+
+
+def _search(args: argparse.Namespace, config, db: DatabaseManager) -> int:
+    context_id = None
+    if args.context:
+        context = db.get_context_by_name(args.context)
+        if context is None:
+            print(f"error: unknown context '{args.context}'", file=sys.stderr)
+            return 2
+        context_id = context.id
+
+    messages = db.search_messages(
+        " ".join(args.query),
+        SEARCH_TYPES[args.type],
+        limit=args.limit,
+        start=datetime.fromisoformat(args.since) if args.since else None,
+        end=datetime.fromisoformat(args.until) if args.until else None,
+        context_id=context_id,
+        thread_id=args.thread,
+    )
+    for msg in messages:
+        print(
+            f"{msg.timestamp:%Y-%m-%d %H:%M}  [{msg.context_name or '-'}]  "
+            f"thread {msg.thread_id}"
+        )
+        print(f"  you: {_one_line(msg.user_message)}")
+        print(f"  assistant: {_one_line(msg.assistant_message)}")
+    print(f"Found {len(messages)} results", file=sys.stderr)
+    return 0
+
+
+def _history(args: argparse.Namespace, config, db: DatabaseManager) -> int:
+    if args.thread is None:
+        for thread in db.get_recent_threads(limit=args.limit):
+            print(
+                f"{thread.thread_id}  {thread.last_message_at:%Y-%m-%d %H:%M}  "
+                f"{thread.message_count:>3} msgs  {_one_line(thread.first_message, 60)}"
+            )
+        return 0
+
+    for msg in db.get_messages(thread_id=args.thread, limit=args.limit):
+        print(f"## You ({msg.timestamp:%Y-%m-%d %H:%M})\n{msg.user_message}\n")
+        print(f"## Assistant\n{msg.assistant_message}\n")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="toolbar-chat", description="Headless AI Chat Toolbar client"
+    )
+    parser.add_argument(
+        "--db", help="database path (defaults to database_path from the config)"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ask = subparsers.add_parser("ask", help="ask a question and stream the answer")
+    ask.add_argument("prompt", nargs="*", help="prompt text, or - to read stdin")
+    ask.add_argument("-c", "--context", help="name of a saved context")
+    ask.add_argument("-t", "--thread", type=float, help="continue an existing thread")
+    ask.add_argument("-m", "--model", help="override the configured model")
+    ask.add_argument(
+        "--history",
+        type=int,
+        default=20,
+        help="previous thread messages to send when continuing (default: 20)",
+    )
+    ask.set_defaults(handler=_ask)
+
+    batch = subparsers.add_parser(
+        "batch", help="run a context against a file of prompts"
+    )
+    batch.add_argument("file", help="prompts, one per line (or .jsonl)")
+    batch.add_argument("-c", "--context", help="name of a saved context")
+    batch.add_argument("-m", "--model", help="override the configured model")
+    batch.add_argument(
+        "-j", "--concurrency", type=int, default=8, help="requests in flight"
+    )
+    batch.add_argument(
+        "--name", help="batch key to resume under (default: file path + context)"
+    )
+    batch.set_defaults(handler=_batch)
+
+    search = subparsers.add_parser("search", help="search the chat history")
+    search.add_argument("query", nargs="*")
+    search.add_argument("--type", choices=sorted(SEARCH_TYPES), default="all")
+    search.add_argument("-c", "--context", help="only messages sent with a context")
+    search.add_argument("-t", "--thread", type=float, help="only one thread")
+    search.add_argument("--since", help="start date, inclusive (YYYY-MM-DD)")
+    search.add_argument("--until", help="end date, exclusive (YYYY-MM-DD)")
+    search.add_argument("-n", "--limit", type=int, default=50)
+    search.set_defaults(handler=_search)
+
+    usage = subparsers.add_parser("usage", help="report token usage")
+    usage.add_argument("-d", "--days", type=int, default=30)
+    usage.add_argument("--daily", action="store_true", help="one row per day")
+    usage.set_defaults(handler=_usage)
+
+    history = subparsers.add_parser("history", help="list threads or show one")
+    history.add_argument("-t", "--thread", type=float, help="thread to print")
+    history.add_argument("-n", "--limit", type=int, default=20)
+    history.set_defaults(handler=_history)
+
+    return parser
+
+
+async def _watched(command: Awaitable[int]) -> int:
+    # Stalls can only be detected once the loop that runs the command is running
+    diagnostics.watch_event_loop()
+    return await command
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    config = ConfigManager().config
+    db = DatabaseManager(args.db or config.database_path)
+
+    if diagnostics.enabled_by_env():
+        diagnostics.start()
+    try:
+        result = args.handler(args, config, db)
+        if not isinstance(result, int):
+            import asyncio
+
+            result = asyncio.run(_watched(result))
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        path = diagnostics.stop(vars(config))
+        if path:
+            print(f"Diagnostics bundle written to {path}", file=sys.stderr)
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(main())
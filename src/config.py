@@ -1,21 +1,49 @@
-from dataclasses import dataclass
-from typing import Optional
+from dataclasses import dataclass, fields
+from typing import Optional, Set
 import os
 import json
+import logging
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class AppConfig:
     openai_api_key: str
     model_name: str = "gpt-4o-mini"
+    openai_base_url: str = ""
+    auto_fast_model: str = "gpt-4o-mini"
+    auto_strong_model: str = "gpt-4o"
+    latency_target_seconds: float = 8.0
+    hedge_enabled: bool = False
+    hedge_percentile: int = 95
+    hedge_budget: float = 0.1
+    hedge_default_delay: float = 4.0
+    hedge_model: str = ""
+    daily_token_soft_budget: int = 0
+    daily_token_hard_budget: int = 0
+    queue_concurrency: int = 2
     database_path: str = "chat_history.db"
+    render_cache_size: int = 500
+    persist_render_cache: bool = False
     max_history_items: int = 100
     default_context: str = ""
     window_width: int = 800
     window_height: int = 600
 
 
+def diff_configs(old: Optional[AppConfig], new: AppConfig) -> Set[str]:
+    """Return the names of the settings that differ between two configs."""
+    if old is None:
+        return {field.name for field in fields(AppConfig)}
+    return {
+        field.name
+        for field in fields(AppConfig)
+        if getattr(old, field.name) != getattr(new, field.name)
+    }
+
+
 class ConfigManager:
     def __init__(self):
         self.config_file = Path.home() / ".toolbar_chat" / "config.json"
@@ -38,8 +66,27 @@ class ConfigManager:
         default_config = AppConfig(openai_api_key=os.environ.get("OPENAI_API_KEY", ""))
         self.save_config(default_config)
 
-    def save_config(self, config: AppConfig) -> None:
+    def reload(self) -> Set[str]:
+        """Re-read the config file and return the settings that changed.
+
+        A missing or unreadable file (e.g. an editor mid-save) keeps the
+        current config.
+        """
+        if not self.config_file.exists():
+            return set()
+        old_config = self.config
+        try:
+            self._load_config()
+        except RuntimeError as e:
+            logger.warning(f"Ignoring config change: {e}")
+            self.config = old_config
+            return set()
+        return diff_configs(old_config, self.config)
+
+    def save_config(self, config: AppConfig) -> Set[str]:
         self.config_file.parent.mkdir(parents=True, exist_ok=True)
         with open(self.config_file, "w") as f:
             json.dump(vars(config), f, indent=4)
+        changed = diff_configs(self.config, config)
         self.config = config
+        return changed
@@ -1,8 +1,63 @@
+import gzip
+import hashlib
+import json
 import sqlite3
 from contextlib import contextmanager
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import List, Optional, Generator
+from typing import Any, Dict, Iterator, List, Optional, Generator, Set, Tuple
+
+from diagnostics import trace
+
+EXPORT_FORMAT = "toolbar-chat-history"
+EXPORT_VERSION = 1
+IMPORT_BATCH_SIZE = 5000
+# search_messages() context filter for messages sent without a context
+NO_CONTEXT = 0
+
+# outbound_queue states
+QUEUED = "queued"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+
+_CONTEXT_COLUMNS = ("name", "content", "created_at", "updated_at")
+_MESSAGE_COLUMNS = (
+    "user_message",
+    "assistant_message",
+    "context_id",
+    "thread_id",
+    "timestamp",
+    "truncated",
+    "model",
+    "hedge_winner",
+    "prompt_tokens",
+    "completion_tokens",
+    "cached_tokens",
+    "context_hash",
+)
+
+# search_messages() query, filled in with the conditions from _search_filter()
+_SEARCH_SQL = """
+    SELECT m.*, c.name as context_name, v.content as context_content
+    FROM chat_messages m
+    LEFT JOIN contexts c ON m.context_id = c.id
+    LEFT JOIN context_versions v ON m.context_hash = v.hash
+    WHERE {where}
+    ORDER BY m.timestamp DESC
+    LIMIT ?
+"""
+
+# Columns added to chat_messages after the initial schema, applied in order.
+_MESSAGE_MIGRATIONS = (
+    ("truncated", "INTEGER NOT NULL DEFAULT 0"),
+    ("model", "TEXT"),
+    ("hedge_winner", "TEXT"),
+    ("prompt_tokens", "INTEGER"),
+    ("completion_tokens", "INTEGER"),
+    ("cached_tokens", "INTEGER"),
+    ("context_hash", "TEXT REFERENCES context_versions (hash)"),
+)
 
 
 @dataclass
@@ -14,6 +69,15 @@ class ChatMessage:
     timestamp: datetime
     thread_id: Optional[int]
     context_name: Optional[str] = None
+    truncated: bool = False
+    model: Optional[str] = None
+    hedge_winner: Optional[str] = None
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+    cached_tokens: Optional[int] = None
+    context_hash: Optional[str] = None
+    # Filled by search_messages() from context_versions, not stored
+    context_content: Optional[str] = None
 
 
 @dataclass
@@ -25,6 +89,98 @@ class Context:
     updated_at: datetime
 
 
+@dataclass
+class LatencySample:
+    model: str
+    prompt_tokens: int
+    completion_tokens: int
+    first_token_seconds: float
+    total_seconds: float
+
+    @property
+    def tokens_per_second(self) -> float:
+        generation = self.total_seconds - self.first_token_seconds
+        if generation <= 0:
+            return 0.0
+        return self.completion_tokens / generation
+
+
+@dataclass
+class UsageRow:
+    day: str
+    model: str
+    context_id: Optional[int]
+    context_name: Optional[str]
+    requests: int
+    prompt_tokens: int
+    completion_tokens: int
+    cached_tokens: int
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+@dataclass
+class SearchFacets:
+    # (context_id, context_name, hits); context_id is None for "no context"
+    contexts: List[Tuple[Optional[int], Optional[str], int]] = field(
+        default_factory=list
+    )
+    # ("YYYY-MM", hits), newest month first
+    months: List[Tuple[str, int]] = field(default_factory=list)
+
+
+@dataclass
+class ThreadSummary:
+    thread_id: float
+    message_count: int
+    started_at: datetime
+    last_message_at: datetime
+    first_message: str
+
+
+@dataclass
+class OutboundItem:
+    id: int
+    thread_id: float
+    user_message: str
+    context_id: Optional[int]
+    context_hash: Optional[str]
+    state: str
+    attempts: int
+    next_attempt_at: float
+    last_error: Optional[str]
+    message_id: Optional[int]
+    created_at: datetime
+    # Database the row lives in, since ids repeat across databases. Not stored
+    db_path: str = ""
+
+
+@dataclass
+class ImportResult:
+    contexts: int = 0
+    messages: int = 0
+    skipped: int = 0
+
+
+def context_hash(content: str) -> str:
+    """Content address of a context version."""
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _open_history_file(path: str, mode: str, compress: Optional[bool] = None):
+    if compress is None:
+        if "w" in mode:
+            compress = path.endswith(".gz")
+        else:
+            with open(path, "rb") as f:
+                compress = f.read(2) == b"\x1f\x8b"
+    if compress:
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
 class DatabaseManager:
     def __init__(self, db_path: str):
         self.db_path = db_path
@@ -61,45 +217,504 @@ class DatabaseManager:
                     FOREIGN KEY (context_id) REFERENCES contexts (id)
                 );
 
-                CREATE INDEX IF NOT EXISTS idx_chat_thread_id ON chat_messages(thread_id);
+                CREATE TABLE IF NOT EXISTS context_versions (
+                    hash TEXT PRIMARY KEY,
+                    content TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) WITHOUT ROWID;
+
+                CREATE TABLE IF NOT EXISTS render_cache (
+                    hash TEXT PRIMARY KEY,
+                    html TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                ) WITHOUT ROWID;
+
+                CREATE TABLE IF NOT EXISTS batch_runs (
+                    batch_key TEXT PRIMARY KEY,
+                    thread_id REAL NOT NULL,
+                    context_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+
+                CREATE TABLE IF NOT EXISTS batch_items (
+                    batch_key TEXT NOT NULL,
+                    item_index INTEGER NOT NULL,
+                    prompt_hash TEXT NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    PRIMARY KEY (batch_key, item_index),
+                    FOREIGN KEY (message_id) REFERENCES chat_messages (id)
+                );
+
+                CREATE TABLE IF NOT EXISTS outbound_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    thread_id REAL NOT NULL,
+                    user_message TEXT NOT NULL,
+                    context_id INTEGER,
+                    context_hash TEXT REFERENCES context_versions (hash),
+                    state TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    last_error TEXT,
+                    message_id INTEGER REFERENCES chat_messages (id),
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+
+                CREATE TABLE IF NOT EXISTS model_latency (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    model TEXT NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    first_token_seconds REAL NOT NULL,
+                    total_seconds REAL NOT NULL,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+
+                CREATE INDEX IF NOT EXISTS idx_model_latency_model ON model_latency(model, id);
+                CREATE INDEX IF NOT EXISTS idx_outbound_state ON outbound_queue(state, next_attempt_at);
+                CREATE INDEX IF NOT EXISTS idx_outbound_thread ON outbound_queue(thread_id, id);
                 CREATE INDEX IF NOT EXISTS idx_chat_timestamp ON chat_messages(timestamp);
+                CREATE INDEX IF NOT EXISTS idx_render_cache_created ON render_cache(created_at);
+            """
+            )
+            existing = {
+                row["name"] for row in conn.execute("PRAGMA table_info(chat_messages)")
+            }
+            for column, definition in _MESSAGE_MIGRATIONS:
+                if column not in existing:
+                    conn.execute(
+                        f"ALTER TABLE chat_messages ADD COLUMN {column} {definition}"
+                    )
+            # Composite indexes let filtered searches range-scan in timestamp
+            # order; the thread one also serves plain thread_id lookups
+            conn.executescript(
+                """
+                DROP INDEX IF EXISTS idx_chat_thread_id;
+                CREATE INDEX IF NOT EXISTS idx_chat_thread_timestamp ON chat_messages(thread_id, timestamp);
+                CREATE INDEX IF NOT EXISTS idx_chat_context_timestamp ON chat_messages(context_id, timestamp);
+                UPDATE chat_messages SET context_id = NULL WHERE context_id = '';
+            """
+            )
+            # Daily roll-ups are maintained by a trigger so every insert path,
+            # including bulk imports, keeps them current without rescans
+            conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS usage_daily (
+                    day TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    context_id INTEGER NOT NULL,
+                    requests INTEGER NOT NULL DEFAULT 0,
+                    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+                    completion_tokens INTEGER NOT NULL DEFAULT 0,
+                    cached_tokens INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, model, context_id)
+                ) WITHOUT ROWID;
+
+                CREATE TRIGGER IF NOT EXISTS trg_usage_daily
+                AFTER INSERT ON chat_messages
+                WHEN NEW.prompt_tokens IS NOT NULL OR NEW.completion_tokens IS NOT NULL
+                BEGIN
+                    INSERT INTO usage_daily (day, model, context_id, requests, prompt_tokens, completion_tokens, cached_tokens)
+                    VALUES (
+                        substr(NEW.timestamp, 1, 10),
+                        COALESCE(NEW.model, ''),
+                        COALESCE(NULLIF(NEW.context_id, ''), 0),
+                        1,
+                        COALESCE(NEW.prompt_tokens, 0),
+                        COALESCE(NEW.completion_tokens, 0),
+                        COALESCE(NEW.cached_tokens, 0)
+                    )
+                    ON CONFLICT (day, model, context_id) DO UPDATE SET
+                        requests = requests + 1,
+                        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                        completion_tokens = completion_tokens + excluded.completion_tokens,
+                        cached_tokens = cached_tokens + excluded.cached_tokens;
+                END;
+            """
+            )
+            conn.commit()
+
+    def _insert_message(self, conn: sqlite3.Connection, message: ChatMessage) -> int:
+        cursor = conn.execute(
+            f"""
+            INSERT INTO chat_messages ({", ".join(_MESSAGE_COLUMNS)})
+            VALUES ({", ".join(":" + column for column in _MESSAGE_COLUMNS)})
+            """,
+            vars(message),
+        )
+        return cursor.lastrowid
+
+    def _store_context_version(
+        self,
+        conn: sqlite3.Connection,
+        content: str,
+        created_at: Optional[datetime] = None,
+    ) -> str:
+        digest = context_hash(content)
+        conn.execute(
             """
+            INSERT OR IGNORE INTO context_versions (hash, content, created_at)
+            VALUES (?, ?, ?)
+            """,
+            (digest, content, created_at or datetime.now()),
+        )
+        return digest
+
+    def add_message(
+        self, message: ChatMessage, context_content: Optional[str] = None
+    ) -> int:
+        """Store a message, linking it to the exact context text it was sent with."""
+        with self.get_connection() as conn:
+            if context_content:
+                message.context_hash = self._store_context_version(
+                    conn, context_content
+                )
+            message_id = self._insert_message(conn, message)
+            conn.commit()
+            return message_id
+
+    def get_batch_thread(self, batch_key: str, context_id: Optional[int]) -> float:
+        """Return the thread a batch writes into, creating the batch run on first use."""
+        with self.get_connection() as conn:
+            conn.execute(
+                """
+                INSERT OR IGNORE INTO batch_runs (batch_key, thread_id, context_id)
+                VALUES (?, ?, ?)
+                """,
+                (batch_key, datetime.now().timestamp(), context_id),
+            )
+            conn.commit()
+            row = conn.execute(
+                "SELECT thread_id FROM batch_runs WHERE batch_key = ?", (batch_key,)
+            ).fetchone()
+            return row["thread_id"]
+
+    def get_completed_batch_items(self, batch_key: str) -> Set[Tuple[int, str]]:
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                "SELECT item_index, prompt_hash FROM batch_items WHERE batch_key = ?",
+                (batch_key,),
             )
+            return {(row["item_index"], row["prompt_hash"]) for row in cursor}
+
+    def add_batch_results(
+        self,
+        batch_key: str,
+        results: List[Tuple[int, str, ChatMessage]],
+        context_content: Optional[str] = None,
+    ) -> None:
+        """Store finished batch items and their messages in a single transaction."""
+        with self.get_connection() as conn:
+            version = None
+            if context_content:
+                version = self._store_context_version(conn, context_content)
+            for item_index, prompt_hash, message in results:
+                message.context_hash = version
+                message.id = self._insert_message(conn, message)
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO batch_items (batch_key, item_index, prompt_hash, message_id)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (batch_key, item_index, prompt_hash, message.id),
+                )
+            conn.commit()
 
-    def add_message(self, message: ChatMessage) -> int:
+    def enqueue_outbound(
+        self,
+        thread_id: float,
+        user_message: str,
+        context_id: Optional[int] = None,
+        context_content: Optional[str] = None,
+    ) -> OutboundItem:
+        """Record a prompt before it is sent, so it survives a failed send or a restart."""
         with self.get_connection() as conn:
+            version = None
+            if context_content:
+                version = self._store_context_version(conn, context_content)
             cursor = conn.execute(
                 """
-                INSERT INTO chat_messages (user_message, assistant_message, context_id, thread_id, timestamp)
+                INSERT INTO outbound_queue (thread_id, user_message, context_id, context_hash, created_at)
                 VALUES (?, ?, ?, ?, ?)
-            """,
+                """,
+                (thread_id, user_message, context_id, version, datetime.now()),
+            )
+            conn.commit()
+            return self._get_outbound(conn, cursor.lastrowid)
+
+    def claim_outbound(self, limit: int, now: float) -> List[OutboundItem]:
+        """Mark up to ``limit`` due items in flight and return them, oldest first."""
+        with self.get_connection() as conn:
+            ids = [
+                row["id"]
+                for row in conn.execute(
+                    """
+                    SELECT id FROM outbound_queue
+                    WHERE state = ? AND next_attempt_at <= ?
+                    ORDER BY id ASC
+                    LIMIT ?
+                    """,
+                    (QUEUED, now, limit),
+                )
+            ]
+            conn.executemany(
+                "UPDATE outbound_queue SET state = ? WHERE id = ?",
+                [(IN_FLIGHT, item_id) for item_id in ids],
+            )
+            conn.commit()
+            return [self._get_outbound(conn, item_id) for item_id in ids]
+
+    def next_outbound_attempt(self) -> Optional[float]:
+        with self.get_connection() as conn:
+            row = conn.execute(
+                "SELECT MIN(next_attempt_at) AS next_attempt_at FROM outbound_queue WHERE state = ?",
+                (QUEUED,),
+            ).fetchone()
+            return row["next_attempt_at"]
+
+    def complete_outbound(self, item_id: int, message: ChatMessage) -> OutboundItem:
+        """Store the reply and mark its queue item done in a single transaction."""
+        with self.get_connection() as conn:
+            message.id = self._insert_message(conn, message)
+            conn.execute(
+                "UPDATE outbound_queue SET state = ?, message_id = ?, last_error = NULL WHERE id = ?",
+                (DONE, message.id, item_id),
+            )
+            conn.commit()
+            return self._get_outbound(conn, item_id)
+
+    def requeue_outbound(
+        self,
+        item_id: int,
+        next_attempt_at: float,
+        error: Optional[str] = None,
+        count_attempt: bool = True,
+    ) -> OutboundItem:
+        with self.get_connection() as conn:
+            conn.execute(
+                """
+                UPDATE outbound_queue
+                SET state = ?, next_attempt_at = ?, last_error = ?, attempts = attempts + ?
+                WHERE id = ?
+                """,
+                (QUEUED, next_attempt_at, error, int(count_attempt), item_id),
+            )
+            conn.commit()
+            return self._get_outbound(conn, item_id)
+
+    def fail_outbound(self, item_id: int, error: str) -> OutboundItem:
+        with self.get_connection() as conn:
+            conn.execute(
+                "UPDATE outbound_queue SET state = ?, last_error = ?, attempts = attempts + 1 WHERE id = ?",
+                (FAILED, error, item_id),
+            )
+            conn.commit()
+            return self._get_outbound(conn, item_id)
+
+    def delete_outbound(self, item_id: int) -> None:
+        with self.get_connection() as conn:
+            conn.execute("DELETE FROM outbound_queue WHERE id = ?", (item_id,))
+            conn.commit()
+
+    def reset_in_flight_outbound(self) -> int:
+        """Return items left in flight by a previous run to the queue."""
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                "UPDATE outbound_queue SET state = ?, next_attempt_at = 0 WHERE state = ?",
+                (QUEUED, IN_FLIGHT),
+            )
+            conn.commit()
+            return cursor.rowcount
+
+    def get_outbound(self, thread_id: float) -> List[OutboundItem]:
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                "SELECT * FROM outbound_queue WHERE thread_id = ? ORDER BY id ASC",
+                (thread_id,),
+            )
+            return [self._outbound_item(row) for row in cursor]
+
+    def _get_outbound(self, conn: sqlite3.Connection, item_id: int) -> OutboundItem:
+        row = conn.execute(
+            "SELECT * FROM outbound_queue WHERE id = ?", (item_id,)
+        ).fetchone()
+        return self._outbound_item(row)
+
+    def _outbound_item(self, row: sqlite3.Row) -> OutboundItem:
+        item = dict(row)
+        if isinstance(item["created_at"], str):
+            item["created_at"] = datetime.fromisoformat(item["created_at"])
+        return OutboundItem(**item, db_path=self.db_path)
+
+    def add_latency_sample(self, sample: LatencySample, keep: int = 50) -> None:
+        """Record a sample, keeping only the newest ``keep`` for its model."""
+        with self.get_connection() as conn:
+            conn.execute(
+                """
+                INSERT INTO model_latency (model, prompt_tokens, completion_tokens, first_token_seconds, total_seconds)
+                VALUES (?, ?, ?, ?, ?)
+                """,
                 (
-                    message.user_message,
-                    message.assistant_message,
-                    message.context_id,
-                    message.thread_id,
-                    message.timestamp,
+                    sample.model,
+                    sample.prompt_tokens,
+                    sample.completion_tokens,
+                    sample.first_token_seconds,
+                    sample.total_seconds,
                 ),
             )
+            conn.execute(
+                """
+                DELETE FROM model_latency
+                WHERE model = ? AND id <= (
+                    SELECT id FROM model_latency WHERE model = ?
+                    ORDER BY id DESC LIMIT 1 OFFSET ?
+                )
+                """,
+                (sample.model, sample.model, keep),
+            )
             conn.commit()
-            return cursor.lastrowid
+
+    def get_latency_samples(self, model: str, limit: int = 50) -> List[LatencySample]:
+        """Return the most recent latency samples for a model, oldest first."""
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                """
+                SELECT model, prompt_tokens, completion_tokens, first_token_seconds, total_seconds
+                FROM model_latency
+                WHERE model = ?
+                ORDER BY id DESC
+                LIMIT ?
+                """,
+                (model, limit),
+            )
+            return [LatencySample(**dict(row)) for row in reversed(cursor.fetchall())]
+
+    def get_recent_hedge_flags(self, limit: int) -> List[bool]:
+        """Return whether each of the last ``limit`` replies was hedged, oldest first."""
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                """
+                SELECT hedge_winner IS NOT NULL AS hedged FROM chat_messages
+                ORDER BY id DESC
+                LIMIT ?
+                """,
+                (limit,),
+            )
+            return [bool(row["hedged"]) for row in reversed(cursor.fetchall())]
+
+    def get_daily_token_total(self, day: str) -> int:
+        """Return prompt plus completion tokens used on a day (YYYY-MM-DD)."""
+        with self.get_connection() as conn:
+            row = conn.execute(
+                """
+                SELECT COALESCE(SUM(prompt_tokens + completion_tokens), 0) AS total
+                FROM usage_daily
+                WHERE day = ?
+                """,
+                (day,),
+            ).fetchone()
+            return row["total"]
+
+    def get_usage_report(
+        self, start_day: str, end_day: str, by_day: bool = False
+    ) -> List[UsageRow]:
+        """Return usage per model and context between two days, inclusive."""
+        day_column = "u.day" if by_day else "MIN(u.day) || '..' || MAX(u.day)"
+        group_by = "u.day, u.model, u.context_id" if by_day else "u.model, u.context_id"
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                f"""
+                SELECT
+                    {day_column} AS day,
+                    u.model,
+                    NULLIF(u.context_id, 0) AS context_id,
+                    c.name AS context_name,
+                    SUM(u.requests) AS requests,
+                    SUM(u.prompt_tokens) AS prompt_tokens,
+                    SUM(u.completion_tokens) AS completion_tokens,
+                    SUM(u.cached_tokens) AS cached_tokens
+                FROM usage_daily u
+                LEFT JOIN contexts c ON c.id = u.context_id
+                WHERE u.day BETWEEN ? AND ?
+                GROUP BY {group_by}
+                ORDER BY {"u.day DESC, " if by_day else ""}SUM(u.prompt_tokens + u.completion_tokens) DESC
+                """,
+                (start_day, end_day),
+            )
+            return [UsageRow(**dict(row)) for row in cursor.fetchall()]
 
     def get_messages(
         self,
         thread_id: Optional[int] = None,
         context_id: Optional[int] = None,
         limit: int = 100,
+        newest: bool = False,
     ) -> List[ChatMessage]:
+        """Return messages oldest first, limited to the newest ones if ``newest``."""
+        conditions, params = [], []
+        if thread_id is not None:
+            conditions.append("thread_id = ?")
+            params.append(thread_id)
+        if context_id is not None:
+            conditions.append("context_id = ?")
+            params.append(context_id)
         with self.get_connection() as conn:
-            query = """
+            query = f"""
                 SELECT * FROM chat_messages
-                WHERE thread_id = COALESCE(?, thread_id)
-                AND context_id = COALESCE(?, context_id)
-                ORDER BY timestamp ASC
+                WHERE {" AND ".join(conditions) or "1"}
+                ORDER BY timestamp {"DESC" if newest else "ASC"}
                 LIMIT ?
             """
-            cursor = conn.execute(query, (thread_id, context_id, limit))
-            return [ChatMessage(**dict(row)) for row in cursor.fetchall()]
+            cursor = conn.execute(query, (*params, limit))
+            messages = []
+            for row in cursor.fetchall():
+                row_dict = dict(row)
+                if isinstance(row_dict["timestamp"], str):
+                    row_dict["timestamp"] = datetime.fromisoformat(
+                        row_dict["timestamp"].replace("Z", "+00:00")
+                    )
+                messages.append(ChatMessage(**row_dict))
+            if newest:
+                messages.reverse()
+            return messages
+
+    def get_recent_threads(self, limit: int = 20) -> List[ThreadSummary]:
+        with self.get_connection() as conn:
+            cursor = conn.execute(
+                """
+                SELECT
+                    thread_id,
+                    COUNT(*) AS message_count,
+                    MIN(timestamp) AS started_at,
+                    MAX(timestamp) AS last_message_at,
+                    (
+                        SELECT user_message FROM chat_messages first
+                        WHERE first.thread_id = m.thread_id
+                        ORDER BY first.timestamp ASC
+                        LIMIT 1
+                    ) AS first_message
+                FROM chat_messages m
+                WHERE thread_id IS NOT NULL
+                GROUP BY thread_id
+                ORDER BY last_message_at DESC
+                LIMIT ?
+                """,
+                (limit,),
+            )
+            threads = []
+            for row in cursor.fetchall():
+                row_dict = dict(row)
+                for key in ("started_at", "last_message_at"):
+                    row_dict[key] = datetime.fromisoformat(
+                        row_dict[key].replace("Z", "+00:00")
+                    )
+                threads.append(ThreadSummary(**row_dict))
+            return threads
+
+    def get_context_by_name(self, name: str) -> Optional[Context]:
+        for context in self.get_contexts():
+            if context.name == name:
+                return context
+        return None
 
     def get_contexts(self) -> List[Context]:
         with self.get_connection() as conn:
@@ -125,6 +740,7 @@ class DatabaseManager:
                 """,
                 (context.name, context.content, context.created_at, context.updated_at),
             )
+            self._store_context_version(conn, context.content, context.created_at)
             conn.commit()
             return cursor.lastrowid
 
@@ -138,6 +754,39 @@ class DatabaseManager:
                 """,
                 (context.content, context.updated_at, context.id),
             )
+            self._store_context_version(conn, context.content, context.updated_at)
+            conn.commit()
+
+    def get_context_version(self, digest: str) -> Optional[str]:
+        with self.get_connection() as conn:
+            row = conn.execute(
+                "SELECT content FROM context_versions WHERE hash = ?", (digest,)
+            ).fetchone()
+            return row["content"] if row else None
+
+    def get_rendered(self, digest: str) -> Optional[str]:
+        with self.get_connection() as conn:
+            row = conn.execute(
+                "SELECT html FROM render_cache WHERE hash = ?", (digest,)
+            ).fetchone()
+            return row["html"] if row else None
+
+    def add_rendered(self, digest: str, html: str, limit: int) -> None:
+        """Cache rendered HTML, keeping only the newest entries up to limit."""
+        with self.get_connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO render_cache (hash, html, created_at) VALUES (?, ?, ?)",
+                (digest, html, datetime.now()),
+            )
+            conn.execute(
+                """
+                DELETE FROM render_cache WHERE hash IN (
+                    SELECT hash FROM render_cache
+                    ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (limit,),
+            )
             conn.commit()
 
     def delete_context(self, context_id: int) -> None:
@@ -145,36 +794,69 @@ class DatabaseManager:
             conn.execute("DELETE FROM contexts WHERE id = ?", (context_id,))
             conn.commit()
 
-    def search_messages(
-        self, query: str, search_type: str = "All", limit: int = 50
-    ) -> List[ChatMessage]:
-        """Search messages containing the given query."""
-        with self.get_connection() as conn:
-            sql_query = """
-                SELECT m.*, c.name as context_name
-                FROM chat_messages m
-                LEFT JOIN contexts c ON m.context_id = c.id
-                WHERE
-            """
+    def _search_filter(
+        self,
+        query: str,
+        search_type: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        context_id: Optional[int] = None,
+        thread_id: Optional[float] = None,
+    ) -> Tuple[str, List[Any]]:
+        conditions: List[str] = []
+        params: List[Any] = []
 
+        if context_id == NO_CONTEXT:
+            conditions.append("m.context_id IS NULL")
+        elif context_id is not None:
+            conditions.append("m.context_id = ?")
+            params.append(context_id)
+        if thread_id is not None:
+            conditions.append("m.thread_id = ?")
+            params.append(thread_id)
+        if start is not None:
+            conditions.append("m.timestamp >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("m.timestamp < ?")
+            params.append(end)
+
+        if query:
             if search_type == "User Messages":
-                sql_query += "m.user_message LIKE ?"
+                conditions.append("m.user_message LIKE ?")
+                params.append(f"%{query}%")
             elif search_type == "Assistant Responses":
-                sql_query += "m.assistant_message LIKE ?"
+                conditions.append("m.assistant_message LIKE ?")
+                params.append(f"%{query}%")
             else:  # All
-                sql_query += "(m.user_message LIKE ? OR m.assistant_message LIKE ?)"
+                conditions.append(
+                    "(m.user_message LIKE ? OR m.assistant_message LIKE ?)"
+                )
+                params.extend([f"%{query}%", f"%{query}%"])
 
-            sql_query += """
-                ORDER BY m.timestamp DESC
-                LIMIT ?
-            """
+        return " AND ".join(conditions) or "1", params
 
-            if search_type == "All":
-                params = (f"%{query}%", f"%{query}%", limit)
-            else:
-                params = (f"%{query}%", limit)
+    @trace("search_messages")
+    def search_messages(
+        self,
+        query: str,
+        search_type: str = "All",
+        limit: int = 50,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        context_id: Optional[int] = None,
+        thread_id: Optional[float] = None,
+    ) -> List[ChatMessage]:
+        """Search messages containing the given query.
 
-            cursor = conn.execute(sql_query, params)
+        ``start`` is inclusive and ``end`` exclusive. Pass ``NO_CONTEXT`` as
+        ``context_id`` to match messages sent without a context.
+        """
+        where, params = self._search_filter(
+            query, search_type, start, end, context_id, thread_id
+        )
+        with self.get_connection() as conn:
+            cursor = conn.execute(_SEARCH_SQL.format(where=where), (*params, limit))
             rows = cursor.fetchall()
             messages = []
             for row in rows:
@@ -187,3 +869,153 @@ class DatabaseManager:
                 message = ChatMessage(**row_dict, context_name=context_name)
                 messages.append(message)
             return messages
+
+    def search_facets(
+        self,
+        query: str,
+        search_type: str = "All",
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        context_id: Optional[int] = None,
+        thread_id: Optional[float] = None,
+    ) -> SearchFacets:
+        """Count search hits per context and per month.
+
+        Each facet ignores its own filter, so the counts show what choosing a
+        different context or month would return.
+        """
+        facets = SearchFacets()
+        with self.get_connection() as conn:
+            where, params = self._search_filter(
+                query, search_type, start, end, None, thread_id
+            )
+            cursor = conn.execute(
+                f"""
+                SELECT m.context_id, c.name AS context_name, COUNT(*) AS hits
+                FROM chat_messages m
+                LEFT JOIN contexts c ON m.context_id = c.id
+                WHERE {where}
+                GROUP BY m.context_id
+                ORDER BY hits DESC
+                """,
+                params,
+            )
+            facets.contexts = [
+                (row["context_id"], row["context_name"], row["hits"])
+                for row in cursor.fetchall()
+            ]
+
+            where, params = self._search_filter(
+                query, search_type, None, None, context_id, thread_id
+            )
+            cursor = conn.execute(
+                f"""
+                SELECT substr(m.timestamp, 1, 7) AS month, COUNT(*) AS hits
+                FROM chat_messages m
+                WHERE {where}
+                GROUP BY month
+                ORDER BY month DESC
+                """,
+                params,
+            )
+            facets.months = [(row["month"], row["hits"]) for row in cursor.fetchall()]
+        return facets
+
+    def iter_history(self) -> Iterator[Dict[str, Any]]:
+        """Yield contexts and then messages as plain records, one row at a time."""
+        yield {"type": "header", "format": EXPORT_FORMAT, "version": EXPORT_VERSION}
+        with self.get_connection() as conn:
+            for row in conn.execute("SELECT * FROM contexts ORDER BY id"):
+                yield {"type": "context", **dict(row)}
+            for row in conn.execute("SELECT * FROM context_versions"):
+                yield {"type": "context_version", **dict(row)}
+            for row in conn.execute("SELECT * FROM chat_messages ORDER BY id"):
+                yield {"type": "message", **dict(row)}
+
+    def export_history(self, path: str, compress: Optional[bool] = None) -> int:
+        """Write the history to a JSONL file, gzipped if requested or if path ends in .gz."""
+        count = 0
+        with _open_history_file(path, "w", compress) as f:
+            for record in self.iter_history():
+                f.write(json.dumps(record, default=str))
+                f.write("\n")
+                count += 1
+        return count - 1
+
+    def import_history(self, path: str) -> ImportResult:
+        """Stream a JSONL export back in, skipping contexts and messages already present."""
+        with _open_history_file(path, "r") as f:
+            return self.import_records(json.loads(line) for line in f if line.strip())
+
+    def import_records(self, records: Iterator[Dict[str, Any]]) -> ImportResult:
+        result = ImportResult()
+        context_ids: Dict[Any, int] = {}
+        batch: List[Dict[str, Any]] = []
+
+        with self.get_connection() as conn:
+            for record in records:
+                record_type = record.get("type")
+                if record_type == "header":
+                    if record.get("format") != EXPORT_FORMAT:
+                        raise ValueError("Not a chat history export")
+                    if record.get("version", 0) > EXPORT_VERSION:
+                        raise ValueError(
+                            f"Unsupported export version: {record.get('version')}"
+                        )
+                elif record_type == "context":
+                    self._import_message_batch(conn, batch, result)
+                    cursor = conn.execute(
+                        """
+                        INSERT OR IGNORE INTO contexts (name, content, created_at, updated_at)
+                        VALUES (?, ?, ?, ?)
+                        """,
+                        tuple(record.get(column) for column in _CONTEXT_COLUMNS),
+                    )
+                    result.contexts += cursor.rowcount
+                    row = conn.execute(
+                        "SELECT id FROM contexts WHERE name = ?", (record["name"],)
+                    ).fetchone()
+                    context_ids[record.get("id")] = row["id"]
+                    conn.commit()
+                elif record_type == "context_version":
+                    self._store_context_version(
+                        conn, record["content"], record.get("created_at")
+                    )
+                elif record_type == "message":
+                    values = {column: record.get(column) for column in _MESSAGE_COLUMNS}
+                    values["context_id"] = context_ids.get(record.get("context_id"))
+                    # Exports made before the truncated column existed leave it out
+                    values["truncated"] = bool(values["truncated"])
+                    batch.append(values)
+                    if len(batch) >= IMPORT_BATCH_SIZE:
+                        self._import_message_batch(conn, batch, result)
+            self._import_message_batch(conn, batch, result)
+            conn.commit()
+        return result
+
+    def _import_message_batch(
+        self,
+        conn: sqlite3.Connection,
+        batch: List[Dict[str, Any]],
+        result: ImportResult,
+    ) -> None:
+        if not batch:
+            return
+        cursor = conn.executemany(
+            f"""
+            INSERT INTO chat_messages ({", ".join(_MESSAGE_COLUMNS)})
+            SELECT {", ".join(":" + column for column in _MESSAGE_COLUMNS)}
+            WHERE NOT EXISTS (
+                SELECT 1 FROM chat_messages
+                WHERE thread_id IS :thread_id
+                AND timestamp IS :timestamp
+                AND user_message = :user_message
+            )
+            """,
+            batch,
+        )
+        conn.commit()
+        inserted = cursor.rowcount
+        result.messages += inserted
+        result.skipped += len(batch) - inserted
+        batch.clear()
@@ -0,0 +1,285 @@
+"""On-demand profiling and diagnostics capture.
+
+Capture is started from the tray (or for the whole run by setting
+``TOOLBAR_CHAT_DIAGNOSTICS=1``) and written out as a zip bundle under
+``~/.toolbar_chat/diagnostics``. While no capture is running, the ``trace``
+decorator costs a single global lookup per call.
+"""
+
+import functools
+import inspect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ENV_VAR = "TOOLBAR_CHAT_DIAGNOSTICS"
+BUNDLE_DIR = Path.home() / ".toolbar_chat" / "diagnostics"
+SAMPLE_INTERVAL = 0.005
+HEARTBEAT_INTERVAL = 0.05
+STALL_THRESHOLD = float(os.environ.get("TOOLBAR_CHAT_STALL_MS", "250")) / 1000
+TRACEMALLOC_FRAMES = 10
+
+_session: Optional["DiagnosticsSession"] = None
+
+
+@dataclass
+class HotPathStats:
+    calls: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+    allocated_bytes: int = 0
+
+
+@dataclass
+class Stall:
+    started_at: str
+    seconds: float
+    stack: str
+
+
+def enabled_by_env() -> bool:
+    return os.environ.get(ENV_VAR, "").lower() in ("1", "true", "yes", "on")
+
+
+def is_active() -> bool:
+    return _session is not None
+
+
+def trace(name: str) -> Callable:
+    """Time and measure allocations of a hot path while a capture is running."""
+
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                session = _session
+                if session is None:
+                    return await func(*args, **kwargs)
+                with session.measure(name):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            session = _session
+            if session is None:
+                return func(*args, **kwargs)
+            with session.measure(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def watch_event_loop() -> None:
+    """Watch the running event loop for stalls, once a capture is running."""
+    if _session is not None:
+        _session.watch_event_loop()
+
+
+def start() -> "DiagnosticsSession":
+    global _session
+    if _session is None:
+        _session = DiagnosticsSession()
+        _session.start()
+    return _session
+
+
+def stop(config: Optional[dict] = None) -> Optional[Path]:
+    """Stop the running capture and return the path of its bundle."""
+    global _session
+    session, _session = _session, None
+    if session is None:
+        return None
+    return session.stop(config)
+
+
+class DiagnosticsSession:
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.hot_paths: Dict[str, HotPathStats] = {}
+        self.stalls: List[Stall] = []
+        self.samples: Counter = Counter()
+        self._main_thread_id = threading.main_thread().ident
+        self._stop_event = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._last_beat: Optional[float] = None
+        self._heartbeat = None
+        self._started_tracemalloc = False
+        self._start_snapshot: Optional[tracemalloc.Snapshot] = None
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._started_tracemalloc = True
+        self._start_snapshot = tracemalloc.take_snapshot()
+        self._spawn(self._sample, "diagnostics-sampler")
+        self.watch_event_loop()
+        logger.info("Diagnostics capture started")
+
+    def watch_event_loop(self) -> None:
+        """Start the stall watcher, if called while an event loop is running.
+
+        A loop that is only created and not run yet would never beat, which
+        would read as one long stall.
+        """
+        import asyncio
+
+        if self._heartbeat is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._beat(loop)
+        self._spawn(self._watch_stalls, "diagnostics-stalls")
+
+    def stop(self, config: Optional[dict] = None) -> Path:
+        self._stop_event.set()
+        if self._heartbeat:
+            self._heartbeat.cancel()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+
+        end_snapshot = tracemalloc.take_snapshot()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        path = self._write_bundle(end_snapshot, config or {})
+        logger.info(f"Diagnostics bundle written to {path}")
+        return path
+
+    @contextmanager
+    def measure(self, name: str) -> Iterator[None]:
+        memory_before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            stats = self.hot_paths.setdefault(name, HotPathStats())
+            stats.calls += 1
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+            stats.allocated_bytes += tracemalloc.get_traced_memory()[0] - memory_before
+
+    def _spawn(self, target: Callable[[], None], name: str) -> None:
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _beat(self, loop) -> None:
+        self._last_beat = time.monotonic()
+        if not self._stop_event.is_set():
+            self._heartbeat = loop.call_later(HEARTBEAT_INTERVAL, self._beat, loop)
+
+    def _main_stack(self) -> Optional[object]:
+        return sys._current_frames().get(self._main_thread_id)
+
+    def _sample(self) -> None:
+        while not self._stop_event.wait(SAMPLE_INTERVAL):
+            frame = self._main_stack()
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def _watch_stalls(self) -> None:
+        reported_beat = None
+        while not self._stop_event.wait(STALL_THRESHOLD / 2):
+            last_beat = self._last_beat
+            if last_beat is None or last_beat == reported_beat:
+                continue
+            blocked = time.monotonic() - last_beat - HEARTBEAT_INTERVAL
+            if blocked < STALL_THRESHOLD:
+                continue
+            frame = self._main_stack()
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            reported_beat = last_beat
+            self.stalls.append(
+                Stall(datetime.now().isoformat(timespec="milliseconds"), blocked, stack)
+            )
+            logger.warning(
+                f"Event loop blocked for at least {blocked * 1000:.0f} ms in:\n{stack}"
+            )
+
+    def _write_bundle(self, end_snapshot: tracemalloc.Snapshot, config: dict) -> Path:
+        # Only needed when writing a bundle, kept off the CLI's import path
+        import platform
+        import zipfile
+
+        BUNDLE_DIR.mkdir(parents=True, exist_ok=True)
+        path = BUNDLE_DIR / f"diagnostics-{self.started_at:%Y%m%d-%H%M%S}.zip"
+
+        summary = {
+            "started_at": self.started_at.isoformat(),
+            "stopped_at": datetime.now().isoformat(),
+            "python": sys.version,
+            "platform": platform.platform(),
+            "sample_interval_seconds": SAMPLE_INTERVAL,
+            "stall_threshold_seconds": STALL_THRESHOLD,
+            "samples": sum(self.samples.values()),
+            "stalls": len(self.stalls),
+            # Secrets stay out of bundles that get attached to bug reports
+            "config": {
+                key: value for key, value in config.items() if "api_key" not in key
+            },
+            "hot_paths": {
+                name: asdict(stats) for name, stats in self.hot_paths.items()
+            },
+        }
+
+        self_time: Counter = Counter()
+        for stack, count in self.samples.items():
+            self_time[stack.rsplit(";", 1)[-1]] += count
+        profile = ["# Self samples per function", ""]
+        profile += [
+            f"{count:8d}  {frame}" for frame, count in self_time.most_common(50)
+        ]
+
+        memory = ["# Allocation growth since capture start", ""]
+        memory += [
+            str(stat)
+            for stat in end_snapshot.compare_to(self._start_snapshot, "lineno")[:50]
+        ]
+        memory += ["", "# Largest live allocations", ""]
+        memory += [str(stat) for stat in end_snapshot.statistics("traceback")[:10]]
+
+        stalls = [
+            f"{stall.started_at}  blocked {stall.seconds * 1000:.0f} ms\n{stall.stack}"
+            for stall in self.stalls
+        ]
+
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as bundle:
+            bundle.writestr("summary.json", json.dumps(summary, indent=2))
+            bundle.writestr("profile.txt", "\n".join(profile) + "\n")
+            # Collapsed stacks, loadable by flamegraph.pl and speedscope
+            bundle.writestr(
+                "stacks.folded",
+                "".join(
+                    f"{stack} {count}\n" for stack, count in self.samples.most_common()
+                ),
+            )
+            bundle.writestr("memory.txt", "\n".join(memory) + "\n")
+            bundle.writestr("stalls.txt", "\n".join(stalls))
+        return path
@@ -0,0 +1,78 @@
+"""Hand requests from a second launch to the already running toolbar.
+
+This module only uses the standard library so that a second launch can
+forward its request and exit without loading Qt or the OpenAI client. The
+running instance listens with a ``QLocalServer`` on ``server_name()``, which
+is a Unix domain socket path on POSIX and a named pipe on Windows.
+"""
+
+import getpass
+import json
+import os
+import socket
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+CONNECT_TIMEOUT = 0.5
+RUNNING = "running"
+STALE = "stale"
+ABSENT = "absent"
+
+
+def server_name() -> str:
+    if os.name == "nt":
+        return f"toolbar_chat_{getpass.getuser()}"
+    return str(Path.home() / ".toolbar_chat" / "instance.sock")
+
+
+def forward_to_running_instance(request: Dict[str, Any]) -> bool:
+    """Send a request to the running instance, returning False if there is none."""
+    payload = (json.dumps(request) + "\n").encode("utf-8")
+    try:
+        if os.name == "nt":
+            with open(rf"\\.\pipe\{server_name()}", "r+b", buffering=0) as pipe:
+                pipe.write(payload)
+        else:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(CONNECT_TIMEOUT)
+                sock.connect(server_name())
+                sock.sendall(payload)
+    except OSError:
+        return False
+    return True
+
+
+def instance_state() -> str:
+    """Whether an instance accepts at the address, or one left a stale socket."""
+    try:
+        if os.name == "nt":
+            with open(rf"\\.\pipe\{server_name()}", "r+b", buffering=0):
+                pass
+        else:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(CONNECT_TIMEOUT)
+                sock.connect(server_name())
+    except ConnectionRefusedError:
+        return STALE
+    except FileNotFoundError:
+        return ABSENT
+    except OSError:
+        # Busy or timing out, but something is there
+        return RUNNING
+    return RUNNING
+
+
+@contextmanager
+def startup_lock() -> Iterator[None]:
+    """Serialise the check and listen of launches starting together."""
+    if os.name == "nt":
+        yield
+        return
+    import fcntl
+
+    lock_path = Path(server_name()).with_suffix(".lock")
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
@@ -1,18 +1,53 @@
 import sys
-import asyncio
+import argparse
 from pathlib import Path
-from PyQt6.QtWidgets import QApplication
-from PyQt6.QtGui import QIcon
-from qasync import QEventLoop
+from typing import Any, Dict, List, Optional
 
-from toolbar import ToolbarApp
+from instance import forward_to_running_instance
+
+
+def parse_request(argv: List[str]) -> Optional[Dict[str, Any]]:
+    parser = argparse.ArgumentParser(description="AI Chat Toolbar")
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument("--chat", action="store_true", help="open the chat window")
+    group.add_argument("--search", metavar="TEXT", help="search the chat history")
+    group.add_argument("--ask", metavar="PROMPT", help="send a prompt to the chat")
+    args = parser.parse_args(argv)
+
+    if args.search is not None:
+        return {"action": "search", "text": args.search}
+    if args.ask is not None:
+        return {"action": "ask", "text": args.ask}
+    if args.chat:
+        return {"action": "chat"}
+    return None
 
 
 def main() -> None:
-    app = QApplication(sys.argv)
+    request = parse_request(sys.argv[1:])
+    # A plain second launch just brings up the chat window of the running instance
+    if forward_to_running_instance(request or {"action": "chat"}):
+        return
+
+    import asyncio
+    from PyQt6.QtWidgets import QApplication
+    from PyQt6.QtGui import QIcon
+    from qasync import QEventLoop
+
+    from toolbar import ToolbarApp, listen_for_instances
+
+    app = QApplication(sys.argv[:1])
     app.setQuitOnLastWindowClosed(False)
     app.setApplicationName("AI Chat Toolbar")
 
+    # Claim the instance address before opening the database or the API
+    # client, so of two launches racing past the forward above only one runs
+    instance_server = listen_for_instances()
+    if instance_server is None:
+        if not forward_to_running_instance(request or {"action": "chat"}):
+            print("Another instance is starting, try again shortly", file=sys.stderr)
+        return
+
     loop = QEventLoop(app)
     asyncio.set_event_loop(loop)
 
@@ -20,7 +55,9 @@ def main() -> None:
     if icon_path.exists():
         app.setWindowIcon(QIcon(str(icon_path)))
 
-    toolbar = ToolbarApp()
+    toolbar = ToolbarApp(instance_server)
+    if request:
+        toolbar.handle_request(request)
 
     with loop:
         loop.run_forever()
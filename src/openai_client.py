@@ -1,24 +1,389 @@
-from typing import List, Dict
+import asyncio
+import logging
+import statistics
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Deque, List, Dict, Optional, Tuple
 from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletion
+from openai.types import CompletionUsage
+
+from db_manager import LatencySample
+from router import AUTO_MODEL, ModelRouter, estimate_message_tokens, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+HEDGE_WINDOW = 100
+HEDGE_MIN_SAMPLES = 10
+
+
+def usage_fields(usage: Optional[CompletionUsage]) -> Dict[str, Optional[int]]:
+    """Map an API usage block onto the token columns of a ChatMessage."""
+    if usage is None:
+        return {}
+    details = usage.prompt_tokens_details
+    return {
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "cached_tokens": details.cached_tokens if details else None,
+    }
+
+
+@dataclass
+class HedgeSlot:
+    """One request in the hedge budget window."""
+
+    hedged: bool = False
+
+
+class HedgePolicy:
+    """Decide when a slow request gets a backup copy, within a spend budget.
+
+    The hedge delay is a percentile of recently observed time-to-first-token
+    for the model, and at most ``budget`` of the last ``HEDGE_WINDOW`` requests
+    may be hedged, counting only requests actually seen.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        percentile: int = 95,
+        budget: float = 0.1,
+        default_delay: float = 4.0,
+        hedge_model: str = "",
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.budget = budget
+        self.default_delay = default_delay
+        self.hedge_model = hedge_model
+        self._first_token: Dict[str, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=HEDGE_WINDOW)
+        )
+        self._window: Deque[HedgeSlot] = deque(maxlen=HEDGE_WINDOW)
+
+    def delay_for(self, model: str) -> float:
+        samples = self._first_token.get(model)
+        if not samples or len(samples) < HEDGE_MIN_SAMPLES:
+            return self.default_delay
+        # hedge_percentile comes straight from config.json, and quantiles()
+        # only has cut points for p1 to p99, which can extrapolate below zero
+        percentile = min(99, max(1, int(self.percentile)))
+        return max(0.0, statistics.quantiles(samples, n=100)[percentile - 1])
+
+    def observe(self, model: str, first_token_seconds: float) -> None:
+        self._first_token[model].append(first_token_seconds)
+
+    def load_history(self, hedged: List[bool]) -> None:
+        """Seed the budget window with past requests, oldest first, so a
+        restart does not hand out a fresh budget."""
+        self._window.clear()
+        self._window.extend(HedgeSlot(flag) for flag in hedged)
+
+    def start_request(self) -> HedgeSlot:
+        slot = HedgeSlot()
+        self._window.append(slot)
+        return slot
+
+    def try_hedge(self, slot: HedgeSlot) -> bool:
+        hedged = sum(request.hedged for request in self._window)
+        if hedged + 1 > self.budget * len(self._window):
+            return False
+        slot.hedged = True
+        return True
+
+
+class ChatStream:
+    """Async iterator over the text deltas of a streamed completion.
+
+    Whatever has arrived so far stays available on ``content``, also after the
+    iteration is interrupted.
+    """
+
+    def __init__(
+        self,
+        client: AsyncOpenAI,
+        model: str,
+        messages: List[Dict[str, str]],
+        on_finish: Optional[Callable[["ChatStream"], None]] = None,
+        hedge: Optional[HedgePolicy] = None,
+        on_close: Optional[Callable[[], None]] = None,
+    ):
+        self.client = client
+        self.model = model
+        self.messages = messages
+        self.on_finish = on_finish
+        self.hedge = hedge
+        self.on_close = on_close
+        # "primary" or "hedge" once a backup request was raced, otherwise None
+        self.hedge_winner: Optional[str] = None
+        self.usage: Optional[CompletionUsage] = None
+        self.started_at: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._parts: List[str] = []
+        self._stream = None
+        # Raced requests that were sent and then dropped; their prompts are
+        # still billed, so they are added to the reported usage
+        self._discarded_requests = 0
+
+    @property
+    def content(self) -> str:
+        return "".join(self._parts)
+
+    def usage_fields(self) -> Dict[str, Optional[int]]:
+        """Token columns for the reply, estimated if it ended before the usage chunk."""
+        if self.usage is not None:
+            return usage_fields(self.usage)
+        # Stopped and cut off replies are still billed, so budgets must see them
+        return {
+            "prompt_tokens": estimate_message_tokens(self.messages)
+            * (1 + self._discarded_requests),
+            "completion_tokens": estimate_tokens(self.content) if self.content else 0,
+        }
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self._iterate()
+
+    async def _iterate(self) -> AsyncIterator[str]:
+        self.started_at = time.monotonic()
+        try:
+            if self.hedge and self.hedge.enabled:
+                self._stream, chunks, text = await self._race()
+            else:
+                self._stream, chunks, text = await self._start(self.model)
+            while text is not None:
+                if text:
+                    if self.first_token_at is None:
+                        self.first_token_at = time.monotonic()
+                        if self.hedge:
+                            self.hedge.observe(
+                                self.model, self.first_token_at - self.started_at
+                            )
+                    self._parts.append(text)
+                    yield text
+                text = await self._next_text(chunks)
+            self.finished_at = time.monotonic()
+        except Exception as e:
+            logger.error(f"OpenAI API error: {e}")
+            raise
+        finally:
+            await self.close()
+        if self.on_finish:
+            self.on_finish(self)
+
+    async def _start(self, model: str) -> Tuple[object, AsyncIterator, Optional[str]]:
+        """Open a stream and wait for its first piece of text."""
+        stream = await self.client.chat.completions.create(
+            model=model,
+            messages=self.messages,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        try:
+            chunks = stream.__aiter__()
+            text = await self._next_text(chunks)
+            while text == "":
+                text = await self._next_text(chunks)
+        except BaseException:
+            await stream.close()
+            raise
+        return stream, chunks, text
+
+    async def _next_text(self, chunks: AsyncIterator) -> Optional[str]:
+        """Return the next text delta, "" for chunks without text, None at the end."""
+        try:
+            chunk = await chunks.__anext__()
+        except StopAsyncIteration:
+            return None
+        if chunk.usage:
+            self.usage = chunk.usage
+            if self._discarded_requests:
+                extra = chunk.usage.prompt_tokens * self._discarded_requests
+                self.usage = chunk.usage.model_copy(
+                    update={
+                        "prompt_tokens": chunk.usage.prompt_tokens + extra,
+                        "total_tokens": chunk.usage.total_tokens + extra,
+                    }
+                )
+        if not chunk.choices:
+            return ""
+        return chunk.choices[0].delta.content or ""
+
+    async def _race(self) -> Tuple[object, AsyncIterator, Optional[str]]:
+        """Start the request and, if it is slow to produce its first token,
+        a backup. Whichever answers first is kept and the other is cancelled."""
+        slot = self.hedge.start_request()
+        primary = asyncio.create_task(self._start(self.model))
+        tasks = {primary: ("primary", self.model)}
+        winner = None
+        try:
+            done, _ = await asyncio.wait(
+                tasks, timeout=self.hedge.delay_for(self.model)
+            )
+            if not done and self.hedge.try_hedge(slot):
+                hedge_model = self.hedge.hedge_model or self.model
+                logger.info(f"Hedging slow request to {self.model} with {hedge_model}")
+                tasks[asyncio.create_task(self._start(hedge_model))] = (
+                    "hedge",
+                    hedge_model,
+                )
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                winner = next((task for task in done if not task.exception()), None)
+                if winner is not None or not pending:
+                    break
+            if winner is None:
+                # Every attempt failed, surface the primary's error
+                raise primary.exception()
+
+            if len(tasks) > 1:
+                self.hedge_winner, self.model = tasks[winner]
+            return winner.result()
+        finally:
+            for task in tasks:
+                if task is not winner:
+                    await self._discard(task)
+
+    async def _discard(self, task: asyncio.Task) -> None:
+        if not task.done():
+            task.cancel()
+        try:
+            stream, _, _ = await task
+        except asyncio.CancelledError:
+            # Already sent, so the server has most likely started on it
+            self._discarded_requests += 1
+            return
+        except Exception:
+            return
+        self._discarded_requests += 1
+        await stream.close()
+
+    async def close(self) -> None:
+        stream, self._stream = self._stream, None
+        if stream is not None:
+            await stream.close()
+        on_close, self.on_close = self.on_close, None
+        if on_close:
+            on_close()
 
 
 class OpenAIWrapper:
-    def __init__(self, api_key: str, model: str = "gpt-4"):
-        self.client = AsyncOpenAI(api_key=api_key)
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gpt-4",
+        base_url: str = "",
+        router: Optional[ModelRouter] = None,
+        hedge: Optional[HedgePolicy] = None,
+    ):
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url or None)
+        # Requests still running on each client, keyed by id(), and clients
+        # replaced by reconfigure() that are closed once their last request ends
+        self._client_users: Dict[int, int] = defaultdict(int)
+        self._retired_clients: Dict[int, AsyncOpenAI] = {}
         self.model = model
+        self.router = router
+        self.hedge = hedge or HedgePolicy()
+
+    def reconfigure(self, api_key: str, base_url: str = "") -> None:
+        """Swap in a client for new credentials.
+
+        Requests already running keep the old client, whose connection pool is
+        closed when the last of them finishes.
+        """
+        old_client = self.client
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url or None)
+        if self._client_users.get(id(old_client)):
+            self._retired_clients[id(old_client)] = old_client
+        else:
+            self._close_client(old_client)
+
+    def _acquire_client(self) -> AsyncOpenAI:
+        client = self.client
+        self._client_users[id(client)] += 1
+        return client
+
+    def _release_client(self, client: AsyncOpenAI) -> None:
+        self._client_users[id(client)] -= 1
+        if self._client_users[id(client)] > 0:
+            return
+        del self._client_users[id(client)]
+        retired = self._retired_clients.pop(id(client), None)
+        if retired is not None:
+            self._close_client(retired)
+
+    def _close_client(self, client: AsyncOpenAI) -> None:
+        try:
+            asyncio.get_running_loop().create_task(client.close())
+        except RuntimeError:
+            pass
+
+    def resolve_model(
+        self, messages: List[Dict[str, str]], model: Optional[str] = None
+    ) -> str:
+        model = model or self.model
+        if model == AUTO_MODEL:
+            if self.router is None:
+                raise ValueError("Automatic model selection needs a ModelRouter")
+            return self.router.choose(estimate_message_tokens(messages))
+        return model
 
     async def send_message(
         self, messages: List[Dict[str, str]], context: str = ""
     ) -> ChatCompletion:
+        client = self._acquire_client()
         try:
             if context:
                 messages.insert(0, {"role": "system", "content": context})
 
-            response = await self.client.chat.completions.create(
-                model=self.model, messages=messages
+            response = await client.chat.completions.create(
+                model=self.resolve_model(messages), messages=messages
             )
             return response
         except Exception as e:
-            self.logger.error(f"OpenAI API error: {e}")
+            logger.error(f"OpenAI API error: {e}")
             raise
+        finally:
+            self._release_client(client)
+
+    def stream_message(
+        self,
+        messages: List[Dict[str, str]],
+        context: str = "",
+        model: Optional[str] = None,
+    ) -> ChatStream:
+        if context:
+            messages = [{"role": "system", "content": context}, *messages]
+        model = self.resolve_model(messages, model)
+        client = self._acquire_client()
+        return ChatStream(
+            client,
+            model,
+            messages,
+            on_finish=self._record_stream if self.router else None,
+            hedge=self.hedge,
+            on_close=lambda: self._release_client(client),
+        )
+
+    def _record_stream(self, stream: ChatStream) -> None:
+        # Only complete, unhedged streams tell us both time to first token and
+        # throughput for a single model
+        if stream.first_token_at is None or stream.finished_at is None:
+            return
+        if stream.hedge_winner is not None:
+            return
+        self.router.record(
+            LatencySample(
+                model=stream.model,
+                prompt_tokens=estimate_message_tokens(stream.messages),
+                completion_tokens=estimate_tokens(stream.content),
+                first_token_seconds=stream.first_token_at - stream.started_at,
+                total_seconds=stream.finished_at - stream.started_at,
+            )
+        )
@@ -0,0 +1,266 @@
+"""Durable outbound queue: prompts are stored before dispatch and sent in the background."""
+
+import asyncio
+import logging
+import random
+import time
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Set
+
+from openai import APIConnectionError, APIStatusError
+
+from db_manager import (
+    DatabaseManager,
+    ChatMessage,
+    Context,
+    OutboundItem,
+    FAILED,
+    QUEUED,
+)
+from diagnostics import trace
+from openai_client import OpenAIWrapper
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 300.0
+PROBE_TIMEOUT = 5.0
+PROBE_MAX_INTERVAL = 60.0
+BUDGET_RECHECK_INTERVAL = 60.0
+# Status codes worth retrying; other client errors fail the item straight away
+RETRYABLE_STATUS = {408, 409, 429}
+# Reported for items that were removed, or cancelled before any reply arrived.
+# Never stored, the row is deleted instead.
+REMOVED = "removed"
+
+
+def retry_delay(attempts: int) -> float:
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** max(0, attempts - 1))
+    # Jitter keeps a burst of failed items from retrying in lockstep
+    return delay * random.uniform(0.5, 1.0)
+
+
+class OutboundQueue:
+    def __init__(
+        self,
+        api_client: OpenAIWrapper,
+        db: DatabaseManager,
+        concurrency: int = 2,
+        hard_budget: int = 0,
+        on_change: Optional[
+            Callable[[OutboundItem, Optional[ChatMessage]], None]
+        ] = None,
+    ):
+        self.api_client = api_client
+        self.db = db
+        self.concurrency = max(1, concurrency)
+        self.hard_budget = hard_budget
+        self.on_change = on_change
+        self.online = True
+        self._probe_interval = RETRY_BASE_DELAY
+        self._tasks: Dict[int, asyncio.Task] = {}
+        self._cancelled: Set[int] = set()
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._runner:
+            return
+        # Nothing else sends from the queue, so anything in flight was cut off
+        # by the previous run exiting
+        reset = self.db.reset_in_flight_outbound()
+        if reset:
+            logger.info(f"Requeued {reset} interrupted outbound messages")
+        self._runner = asyncio.ensure_future(self._run())
+
+    def stop(self) -> None:
+        """Stop sending. Items in flight stay in flight and are resent on next start."""
+        if self._runner:
+            self._runner.cancel()
+            self._runner = None
+        for task in self._tasks.values():
+            task.cancel()
+
+    def switch_db(self, db: DatabaseManager) -> None:
+        """Send from another database once the items in flight have finished.
+
+        Items still queued in the old database stay there and are sent the
+        next time it is used.
+        """
+        if self._runner:
+            self._runner.cancel()
+            self._runner = None
+        # New items go to the new database straight away, while items in
+        # flight finish in the database they were claimed from
+        self.db = db
+        asyncio.ensure_future(self._start_when_idle(list(self._tasks.values())))
+
+    async def _start_when_idle(self, tasks: List[asyncio.Task]) -> None:
+        if tasks:
+            await asyncio.wait(tasks)
+        self.start()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def reset_connectivity(self) -> None:
+        """Try the API again straight away, e.g. after its address changed."""
+        self.online = True
+        self._probe_interval = RETRY_BASE_DELAY
+        self.wake()
+
+    def enqueue(
+        self, thread_id: float, user_message: str, context: Optional[Context] = None
+    ) -> OutboundItem:
+        item = self.db.enqueue_outbound(
+            thread_id,
+            user_message,
+            context_id=context.id if context else None,
+            context_content=context.content if context else None,
+        )
+        self._notify(item)
+        self.wake()
+        return item
+
+    def cancel(self, item_id: int) -> None:
+        """Stop an item in flight, keeping whatever part of the reply arrived."""
+        task = self._tasks.get(item_id)
+        if task:
+            self._cancelled.add(item_id)
+            task.cancel()
+
+    def remove(self, item: OutboundItem) -> None:
+        if (
+            item.state not in (QUEUED, FAILED)
+            or item.id in self._tasks
+            or item.db_path != self.db.db_path
+        ):
+            return
+        self.db.delete_outbound(item.id)
+        item.state = REMOVED
+        self._notify(item)
+
+    def retry(self, item: OutboundItem) -> None:
+        if item.state != FAILED or item.db_path != self.db.db_path:
+            return
+        self._notify(
+            self.db.requeue_outbound(item.id, 0, item.last_error, count_attempt=False)
+        )
+        self.wake()
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            try:
+                timeout = await self._drain()
+            except Exception as e:
+                logger.error(f"Outbound queue error: {e}")
+                timeout = RETRY_BASE_DELAY
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _drain(self) -> Optional[float]:
+        """Start due items up to the concurrency limit and return how long to sleep."""
+        if not self.online:
+            if not await self._probe():
+                self._probe_interval = min(PROBE_MAX_INTERVAL, self._probe_interval * 2)
+                return self._probe_interval
+            logger.info("Connectivity restored, draining the outbound queue")
+            self.reset_connectivity()
+
+        if self.hard_budget and (
+            self.db.get_daily_token_total(date.today().isoformat()) >= self.hard_budget
+        ):
+            return BUDGET_RECHECK_INTERVAL
+
+        free = self.concurrency - len(self._tasks)
+        if free <= 0:
+            # A finishing item wakes the queue
+            return None
+        for item in self.db.claim_outbound(free, time.time()):
+            self._notify(item)
+            self._tasks[item.id] = asyncio.create_task(self._dispatch(item, self.db))
+
+        next_attempt = self.db.next_outbound_attempt()
+        if next_attempt is None or len(self._tasks) >= self.concurrency:
+            return None
+        return max(0.0, next_attempt - time.time())
+
+    async def _probe(self) -> bool:
+        url = self.api_client.client.base_url
+        port = url.port or (443 if url.scheme == "https" else 80)
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(url.host, port), PROBE_TIMEOUT
+            )
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        return True
+
+    @trace("dispatch")
+    async def _dispatch(self, item: OutboundItem, db: DatabaseManager) -> None:
+        try:
+            context = ""
+            if item.context_hash:
+                context = db.get_context_version(item.context_hash) or ""
+            stream = self.api_client.stream_message(
+                [{"role": "user", "content": item.user_message}], context=context
+            )
+            truncated = False
+            try:
+                async for _ in stream:
+                    pass
+            except asyncio.CancelledError:
+                if item.id not in self._cancelled:
+                    # Shutting down, resent on next start
+                    raise
+                if not stream.content:
+                    db.delete_outbound(item.id)
+                    item.state = REMOVED
+                    self._notify(item)
+                    return
+                truncated = True
+
+            message = ChatMessage(
+                id=None,
+                user_message=item.user_message,
+                assistant_message=stream.content,
+                context_id=item.context_id,
+                timestamp=datetime.now(),
+                thread_id=item.thread_id,
+                truncated=truncated,
+                model=stream.model,
+                hedge_winner=stream.hedge_winner,
+                context_hash=item.context_hash,
+                **stream.usage_fields(),
+            )
+            self._notify(db.complete_outbound(item.id, message), message)
+        except APIConnectionError as e:
+            # Not the item's fault, so it keeps its attempts and goes out as
+            # soon as the API is reachable again
+            logger.warning(f"API unreachable, holding outbound messages: {e}")
+            self.online = False
+            self._notify(db.requeue_outbound(item.id, 0, str(e), count_attempt=False))
+        except APIStatusError as e:
+            retryable = e.status_code >= 500 or e.status_code in RETRYABLE_STATUS
+            if retryable and item.attempts + 1 < MAX_ATTEMPTS:
+                next_attempt_at = time.time() + retry_delay(item.attempts + 1)
+                self._notify(db.requeue_outbound(item.id, next_attempt_at, str(e)))
+            else:
+                self._notify(db.fail_outbound(item.id, str(e)))
+        except Exception as e:
+            self._notify(db.fail_outbound(item.id, str(e)))
+        finally:
+            self._tasks.pop(item.id, None)
+            self._cancelled.discard(item.id)
+            self.wake()
+
+    def _notify(
+        self, item: OutboundItem, message: Optional[ChatMessage] = None
+    ) -> None:
+        if self.on_change:
+            self.on_change(item, message)
@@ -0,0 +1,112 @@
+"""Markdown to HTML rendering off the GUI thread, with a render cache."""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+import markdown2
+
+from db_manager import DatabaseManager
+
+logger = logging.getLogger(__name__)
+
+MARKDOWN_EXTRAS = ["fenced-code-blocks", "tables", "break-on-newline", "code-friendly"]
+# Bump when the extras or the markdown2 output change, so cached HTML is not reused
+RENDER_VERSION = 1
+# Shorter content renders faster inline than a round trip to a worker process
+INLINE_RENDER_CHARS = 2000
+RENDER_WORKERS = 2
+
+
+def render_markdown(content: str) -> str:
+    return markdown2.markdown(content, extras=MARKDOWN_EXTRAS)
+
+
+def render_key(content: str) -> str:
+    return hashlib.sha256(f"{RENDER_VERSION}\0{content}".encode("utf-8")).hexdigest()
+
+
+class MarkdownRenderer:
+    def __init__(
+        self,
+        db: Optional[DatabaseManager] = None,
+        cache_size: int = 500,
+        persist: bool = False,
+    ):
+        self.db = db
+        self.cache_size = cache_size
+        self.persist = persist
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def cached(self, content: str) -> Optional[str]:
+        """Return the HTML for content if it was rendered before, without rendering."""
+        key = render_key(content)
+        html = self._cache.get(key)
+        if html is not None:
+            self._cache.move_to_end(key)
+            return html
+        if self.persist and self.db:
+            html = self.db.get_rendered(key)
+            if html is not None:
+                self._remember(key, html)
+        return html
+
+    def render_now(self, content: str) -> str:
+        """Render on the calling thread, for callers that cannot wait."""
+        html = self.cached(content)
+        if html is None:
+            html = render_markdown(content)
+            self._store(content, html)
+        return html
+
+    async def render(self, content: str) -> str:
+        html = self.cached(content)
+        if html is not None:
+            return html
+        if len(content) < INLINE_RENDER_CHARS:
+            html = render_markdown(content)
+        else:
+            loop = asyncio.get_running_loop()
+            try:
+                html = await loop.run_in_executor(
+                    self._get_pool(), render_markdown, content
+                )
+            except BrokenProcessPool as e:
+                logger.warning(f"Render worker died, rendering inline: {e}")
+                self._pool = None
+                html = render_markdown(content)
+        self._store(content, html)
+        return html
+
+    def shutdown(self) -> None:
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        # markdown2 is pure Python, so threads would still hold the GIL the GUI needs.
+        # Spawned workers avoid forking a process that is running Qt threads.
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    def _store(self, content: str, html: str) -> None:
+        key = render_key(content)
+        self._remember(key, html)
+        if self.persist and self.db:
+            self.db.add_rendered(key, html, self.cache_size)
+
+    def _remember(self, key: str, html: str) -> None:
+        self._cache[key] = html
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
@@ -0,0 +1,90 @@
+"""Pick a model per request from prompt size and locally recorded latency."""
+
+import statistics
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional
+
+from db_manager import DatabaseManager, LatencySample
+
+AUTO_MODEL = "auto"
+HISTORY_SIZE = 50
+# Prompts at or above this size are worth the slower, stronger model
+HEAVY_PROMPT_TOKENS = 1500
+# Recorded prompt sizes must span this many tokens before time to first token
+# is fitted against size; below that it is treated as fixed overhead
+MIN_FIT_SPAN = 500
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def estimate_message_tokens(messages: List[Dict[str, str]]) -> int:
+    return sum(estimate_tokens(message["content"]) for message in messages)
+
+
+class ModelRouter:
+    def __init__(
+        self,
+        db: Optional[DatabaseManager],
+        fast_model: str = "gpt-4o-mini",
+        strong_model: str = "gpt-4o",
+        latency_target: float = 8.0,
+    ):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.latency_target = latency_target
+        self._history: Dict[str, Deque[LatencySample]] = defaultdict(
+            lambda: deque(maxlen=HISTORY_SIZE)
+        )
+        self.set_db(db)
+
+    def set_db(self, db: Optional[DatabaseManager]) -> None:
+        self.db = db
+        self._history.clear()
+        if db is None:
+            return
+        for model in (self.fast_model, self.strong_model):
+            for sample in db.get_latency_samples(model, HISTORY_SIZE):
+                self._history[model].append(sample)
+
+    def choose(self, prompt_tokens: int) -> str:
+        """Route light prompts to the fast model and heavy ones to the strong
+        model, unless the strong model is expected to miss the latency target."""
+        if prompt_tokens < HEAVY_PROMPT_TOKENS:
+            return self.fast_model
+        predicted = self.predict_latency(self.strong_model, prompt_tokens)
+        if predicted is None or predicted <= self.latency_target:
+            return self.strong_model
+        return self.fast_model
+
+    def predict_latency(self, model: str, prompt_tokens: int) -> Optional[float]:
+        samples = self._history.get(model)
+        if not samples:
+            return None
+        completion_tokens = statistics.median(
+            sample.completion_tokens for sample in samples
+        )
+        throughput = statistics.median(sample.tokens_per_second for sample in samples)
+        generation = completion_tokens / throughput if throughput > 0 else 0.0
+        return self.predict_first_token(samples, prompt_tokens) + generation
+
+    def predict_first_token(
+        self, samples: Deque[LatencySample], prompt_tokens: int
+    ) -> float:
+        """Time to first token is mostly fixed overhead plus a per-token cost,
+        fitted only when the samples cover enough prompt sizes to tell them apart."""
+        sizes = [sample.prompt_tokens for sample in samples]
+        times = [sample.first_token_seconds for sample in samples]
+        if max(sizes) - min(sizes) < MIN_FIT_SPAN:
+            return statistics.median(times)
+        slope, intercept = statistics.linear_regression(sizes, times)
+        if slope <= 0:
+            return statistics.median(times)
+        return max(0.0, intercept + slope * prompt_tokens)
+
+    def record(self, sample: LatencySample) -> None:
+        self._history[sample.model].append(sample)
+        if self.db is not None:
+            self.db.add_latency_sample(sample, keep=HISTORY_SIZE)
@@ -8,19 +8,33 @@ from PyQt6.QtWidgets import (
     QTableWidgetItem,
     QLabel,
     QComboBox,
+    QCheckBox,
+    QDateEdit,
+    QListWidget,
+    QListWidgetItem,
+    QSplitter,
+    QWidget,
 )
-from db_manager import DatabaseManager
+from PyQt6.QtCore import Qt, QDate
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from db_manager import DatabaseManager, NO_CONTEXT
 
 
 class SearchDialog(QDialog):
-    def __init__(self, db: DatabaseManager, parent=None):
+    def __init__(self, db: DatabaseManager, parent=None, query: str = ""):
         super().__init__(parent)
         self.db = db
         self.setup_ui()
+        self.load_filters()
+        if query:
+            self.search_input.setText(query)
+            self.perform_search()
 
     def setup_ui(self) -> None:
         self.setWindowTitle("Search Chat History")
-        self.setMinimumSize(600, 400)
+        self.setMinimumSize(800, 450)
 
         layout = QVBoxLayout(self)
 
@@ -42,6 +56,39 @@ class SearchDialog(QDialog):
 
         layout.addLayout(search_layout)
 
+        # Filters
+        filter_layout = QHBoxLayout()
+
+        self.date_filter = QCheckBox("From")
+        self.start_date = QDateEdit(QDate.currentDate().addMonths(-1))
+        self.start_date.setCalendarPopup(True)
+        self.end_date = QDateEdit(QDate.currentDate())
+        self.end_date.setCalendarPopup(True)
+        self.date_filter.toggled.connect(self.start_date.setEnabled)
+        self.date_filter.toggled.connect(self.end_date.setEnabled)
+        self.date_filter.setChecked(False)
+        self.start_date.setEnabled(False)
+        self.end_date.setEnabled(False)
+        filter_layout.addWidget(self.date_filter)
+        filter_layout.addWidget(self.start_date)
+        filter_layout.addWidget(QLabel("to"))
+        filter_layout.addWidget(self.end_date)
+
+        self.context_filter = QComboBox()
+        self.context_filter.setMinimumWidth(150)
+        filter_layout.addWidget(QLabel("Context:"))
+        filter_layout.addWidget(self.context_filter)
+
+        self.thread_filter = QComboBox()
+        self.thread_filter.setMinimumWidth(200)
+        filter_layout.addWidget(QLabel("Thread:"))
+        filter_layout.addWidget(self.thread_filter)
+        filter_layout.addStretch()
+
+        layout.addLayout(filter_layout)
+
+        splitter = QSplitter(Qt.Orientation.Horizontal)
+
         # Results table
         self.results_table = QTableWidget()
         self.results_table.setColumnCount(4)
@@ -49,19 +96,80 @@ class SearchDialog(QDialog):
             ["Time", "Context", "User Message", "Assistant Response"]
         )
         self.results_table.horizontalHeader().setStretchLastSection(True)
-        layout.addWidget(self.results_table)
+        splitter.addWidget(self.results_table)
+
+        # Facets, clicking one narrows the search to it
+        facet_widget = QWidget()
+        facet_layout = QVBoxLayout(facet_widget)
+        facet_layout.setContentsMargins(0, 0, 0, 0)
+        facet_layout.addWidget(QLabel("Contexts"))
+        self.context_facets = QListWidget()
+        self.context_facets.itemClicked.connect(self.apply_context_facet)
+        facet_layout.addWidget(self.context_facets)
+        facet_layout.addWidget(QLabel("Months"))
+        self.month_facets = QListWidget()
+        self.month_facets.itemClicked.connect(self.apply_month_facet)
+        facet_layout.addWidget(self.month_facets)
+        splitter.addWidget(facet_widget)
+        splitter.setSizes([600, 200])
+
+        layout.addWidget(splitter)
 
         # Status label
         self.status_label = QLabel()
         layout.addWidget(self.status_label)
 
+    def load_filters(self) -> None:
+        self.context_filter.clear()
+        self.context_filter.addItem("Any", None)
+        self.context_filter.addItem("No Context", NO_CONTEXT)
+        for context in self.db.get_contexts():
+            self.context_filter.addItem(context.name, context.id)
+
+        self.thread_filter.clear()
+        self.thread_filter.addItem("Any", None)
+        for thread in self.db.get_recent_threads(limit=50):
+            title = " ".join(thread.first_message.split())[:40]
+            self.thread_filter.addItem(
+                f"{thread.started_at:%Y-%m-%d %H:%M} {title}", thread.thread_id
+            )
+
+    def date_range(self) -> Tuple[Optional[datetime], Optional[datetime]]:
+        if not self.date_filter.isChecked():
+            return None, None
+        start = self.start_date.date().toPyDate()
+        end = self.end_date.date().toPyDate() + timedelta(days=1)
+        return (
+            datetime(start.year, start.month, start.day),
+            datetime(end.year, end.month, end.day),
+        )
+
+    def apply_context_facet(self, item: QListWidgetItem) -> None:
+        index = self.context_filter.findData(item.data(Qt.ItemDataRole.UserRole))
+        if index >= 0:
+            self.context_filter.setCurrentIndex(index)
+            self.perform_search()
+
+    def apply_month_facet(self, item: QListWidgetItem) -> None:
+        year, month = map(int, item.data(Qt.ItemDataRole.UserRole).split("-"))
+        start = QDate(year, month, 1)
+        self.start_date.setDate(start)
+        self.end_date.setDate(start.addMonths(1).addDays(-1))
+        self.date_filter.setChecked(True)
+        self.perform_search()
+
     def perform_search(self) -> None:
         query = self.search_input.text().strip()
-        if not query:
+        start, end = self.date_range()
+        context_id = self.context_filter.currentData()
+        thread_id = self.thread_filter.currentData()
+        if not query and start is None and context_id is None and thread_id is None:
             return
 
         search_type = self.search_type.currentText()
-        messages = self.db.search_messages(query, search_type)
+        filters = dict(start=start, end=end, context_id=context_id, thread_id=thread_id)
+        messages = self.db.search_messages(query, search_type, **filters)
+        facets = self.db.search_facets(query, search_type, **filters)
 
         self.results_table.setRowCount(0)
         for msg in messages:
@@ -72,6 +180,9 @@ class SearchDialog(QDialog):
             context_item = QTableWidgetItem(
                 msg.context_name if hasattr(msg, "context_name") else ""
             )
+            if msg.context_content:
+                # The context text as it was when the message was sent
+                context_item.setToolTip(msg.context_content)
             user_msg_item = QTableWidgetItem(msg.user_message)
             assistant_msg_item = QTableWidgetItem(msg.assistant_message)
 
@@ -80,4 +191,21 @@ class SearchDialog(QDialog):
             self.results_table.setItem(row, 2, user_msg_item)
             self.results_table.setItem(row, 3, assistant_msg_item)
 
-        self.status_label.setText(f"Found {len(messages)} results")
+        self.context_facets.clear()
+        total = 0
+        for facet_context_id, name, hits in facets.contexts:
+            if facet_context_id is None:
+                facet_context_id, name = NO_CONTEXT, "No Context"
+            item = QListWidgetItem(f"{name or 'Deleted Context'} ({hits})")
+            item.setData(Qt.ItemDataRole.UserRole, facet_context_id)
+            self.context_facets.addItem(item)
+            if context_id is None or context_id == facet_context_id:
+                total += hits
+
+        self.month_facets.clear()
+        for month, hits in facets.months:
+            item = QListWidgetItem(f"{month} ({hits})")
+            item.setData(Qt.ItemDataRole.UserRole, month)
+            self.month_facets.addItem(item)
+
+        self.status_label.setText(f"Showing {len(messages)} of {total} results")
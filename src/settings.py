@@ -6,8 +6,12 @@ from PyQt6.QtWidgets import (
     QPushButton,
     QComboBox,
     QSpinBox,
+    QDoubleSpinBox,
+    QCheckBox,
 )
-from config import AppConfig, ConfigManager
+from dataclasses import replace
+
+from config import ConfigManager
 
 
 class SettingsDialog(QDialog):
@@ -28,9 +32,23 @@ class SettingsDialog(QDialog):
 
         # Model selection
         self.model_combo = QComboBox()
-        self.model_combo.addItems(["gpt-4o", "gpt-4o-mini", "o1", "o1-mini"])
+        self.model_combo.addItems(["auto", "gpt-4o", "gpt-4o-mini", "o1", "o1-mini"])
         form_layout.addRow("Model:", self.model_combo)
 
+        # Latency target used to route requests when the model is "auto"
+        self.latency_target = QDoubleSpinBox()
+        self.latency_target.setRange(1.0, 120.0)
+        self.latency_target.setSingleStep(1.0)
+        self.latency_target.setSuffix(" s")
+        self.model_combo.currentTextChanged.connect(
+            lambda model: self.latency_target.setEnabled(model == "auto")
+        )
+        form_layout.addRow("Auto Latency Target:", self.latency_target)
+
+        # Hedging re-issues requests that are slow to produce a first token
+        self.hedge_checkbox = QCheckBox("Retry slow requests in parallel")
+        form_layout.addRow("Hedging:", self.hedge_checkbox)
+
         # Window dimensions
         self.width_input = QSpinBox()
         self.width_input.setRange(400, 1920)
@@ -48,6 +66,24 @@ class SettingsDialog(QDialog):
         self.history_limit.setSingleStep(10)
         form_layout.addRow("Max History Items:", self.history_limit)
 
+        # Daily token budgets, 0 disables the check
+        self.soft_budget = QSpinBox()
+        self.soft_budget.setRange(0, 100_000_000)
+        self.soft_budget.setSingleStep(10_000)
+        self.soft_budget.setSpecialValueText("Off")
+        form_layout.addRow("Daily Token Warning:", self.soft_budget)
+
+        self.hard_budget = QSpinBox()
+        self.hard_budget.setRange(0, 100_000_000)
+        self.hard_budget.setSingleStep(10_000)
+        self.hard_budget.setSpecialValueText("Off")
+        form_layout.addRow("Daily Token Limit:", self.hard_budget)
+
+        # Queued messages sent at once when connectivity returns
+        self.queue_concurrency = QSpinBox()
+        self.queue_concurrency.setRange(1, 16)
+        form_layout.addRow("Parallel Sends:", self.queue_concurrency)
+
         layout.addLayout(form_layout)
 
         # Buttons
@@ -63,20 +99,28 @@ class SettingsDialog(QDialog):
     def load_settings(self) -> None:
         config = self.config_manager.config
         self.model_combo.setCurrentText(config.model_name)
+        self.latency_target.setValue(config.latency_target_seconds)
+        self.latency_target.setEnabled(config.model_name == "auto")
+        self.hedge_checkbox.setChecked(config.hedge_enabled)
         self.width_input.setValue(config.window_width)
         self.height_input.setValue(config.window_height)
         self.history_limit.setValue(config.max_history_items)
+        self.soft_budget.setValue(config.daily_token_soft_budget)
+        self.hard_budget.setValue(config.daily_token_hard_budget)
+        self.queue_concurrency.setValue(config.queue_concurrency)
 
     def save_settings(self) -> None:
-        current_config = self.config_manager.config
-        new_config = AppConfig(
-            openai_api_key=current_config.openai_api_key,
+        new_config = replace(
+            self.config_manager.config,
             model_name=self.model_combo.currentText(),
+            latency_target_seconds=self.latency_target.value(),
+            hedge_enabled=self.hedge_checkbox.isChecked(),
             window_width=self.width_input.value(),
             window_height=self.height_input.value(),
             max_history_items=self.history_limit.value(),
-            database_path=current_config.database_path,
-            default_context=current_config.default_context,
+            daily_token_soft_budget=self.soft_budget.value(),
+            daily_token_hard_budget=self.hard_budget.value(),
+            queue_concurrency=self.queue_concurrency.value(),
         )
         self.config_manager.save_config(new_config)
         self.accept()
@@ -3,34 +3,102 @@ from PyQt6.QtWidgets import (
     QSystemTrayIcon,
     QMenu,
     QDialog,
+    QFileDialog,
 )
 from PyQt6.QtGui import QIcon, QAction
-from PyQt6.QtCore import QObject, pyqtSignal
-from typing import Optional
+from PyQt6.QtCore import QObject, QFileSystemWatcher, QTimer, pyqtSignal
+from PyQt6.QtNetwork import QAbstractSocket, QLocalServer, QLocalSocket
+from typing import Any, Dict, Optional, Set
 from pathlib import Path
+from datetime import datetime
+import asyncio
+import json
+import logging
 
-from config import ConfigManager
+from config import AppConfig, ConfigManager, diff_configs
 from chat_window import ChatWindow
 from settings import SettingsDialog
-from openai_client import OpenAIWrapper
-from db_manager import DatabaseManager
+from openai_client import HEDGE_WINDOW, HedgePolicy, OpenAIWrapper
+from router import ModelRouter
+from db_manager import DatabaseManager, ChatMessage, OutboundItem, DONE, FAILED
 from context_manager import ContextManagerDialog
 from search import SearchDialog
+from usage import UsageDialog
+from instance import RUNNING, STALE, instance_state, server_name, startup_lock
+from render import MarkdownRenderer
+from outbound import OutboundQueue
+import diagnostics
+
+logger = logging.getLogger(__name__)
+
+
+def listen_for_instances() -> Optional[QLocalServer]:
+    """Become the single running instance.
+
+    Returns None when another instance already listens, so the caller should
+    forward its request there and exit instead of starting.
+    """
+    server = QLocalServer()
+    server.setSocketOptions(QLocalServer.SocketOption.UserAccessOption)
+    # With socket options set, listen() replaces whatever is at the address
+    # rather than failing, so the lock keeps the check and the listen together
+    with startup_lock():
+        state = instance_state()
+        if state == RUNNING:
+            return None
+        if state == STALE:
+            # Connections are refused, so the instance that left it has exited
+            QLocalServer.removeServer(server_name())
+        if server.listen(server_name()):
+            return server
+        if server.serverError() == QAbstractSocket.SocketError.AddressInUseError:
+            return None
+    logger.warning(f"Single-instance server unavailable: {server.errorString()}")
+    return server
 
 
 class ToolbarApp(QObject):
     chat_requested = pyqtSignal()
 
-    def __init__(self):
+    def __init__(self, instance_server: QLocalServer):
         super().__init__()
         self.config_manager = ConfigManager()
         self.setup_app()
+        self.setup_config_watcher()
+        self.setup_instance_server(instance_server)
+        if diagnostics.enabled_by_env():
+            self.start_diagnostics()
+        QApplication.instance().aboutToQuit.connect(self.save_diagnostics)
+        QApplication.instance().aboutToQuit.connect(self.renderer.shutdown)
+        QApplication.instance().aboutToQuit.connect(self.outbound.stop)
 
     def setup_app(self) -> None:
-        self.db = DatabaseManager(self.config_manager.config.database_path)
+        config = self.config_manager.config
+        self.db = DatabaseManager(config.database_path)
+        self.router = ModelRouter(
+            self.db,
+            config.auto_fast_model,
+            config.auto_strong_model,
+            config.latency_target_seconds,
+        )
         self.api_client = OpenAIWrapper(
-            self.config_manager.config.openai_api_key,
-            self.config_manager.config.model_name,
+            config.openai_api_key,
+            config.model_name,
+            config.openai_base_url,
+            router=self.router,
+            hedge=HedgePolicy(),
+        )
+        self.apply_hedge_settings(config)
+        self.api_client.hedge.load_history(self.db.get_recent_hedge_flags(HEDGE_WINDOW))
+        self.renderer = MarkdownRenderer(
+            self.db, config.render_cache_size, config.persist_render_cache
+        )
+        self.outbound = OutboundQueue(
+            self.api_client,
+            self.db,
+            config.queue_concurrency,
+            config.daily_token_hard_budget,
+            on_change=self.handle_outbound_change,
         )
 
         self.tray_icon = QSystemTrayIcon()
@@ -41,6 +109,109 @@ class ToolbarApp(QObject):
         self.chat_requested.connect(self.show_chat_window)
 
         self.tray_icon.show()
+        self.outbound.start()
+
+    def setup_config_watcher(self) -> None:
+        config_path = str(self.config_manager.config_file)
+        self.config_watcher = QFileSystemWatcher([config_path], self)
+        # Editors often write the file in several steps, so wait for it to settle
+        self.config_reload_timer = QTimer(self)
+        self.config_reload_timer.setSingleShot(True)
+        self.config_reload_timer.setInterval(200)
+        self.config_reload_timer.timeout.connect(self.reload_config)
+        self.config_watcher.fileChanged.connect(self.config_reload_timer.start)
+
+    def reload_config(self) -> None:
+        config_path = str(self.config_manager.config_file)
+        # Atomic saves replace the file, which drops it from the watcher
+        if config_path not in self.config_watcher.files():
+            self.config_watcher.addPath(config_path)
+        self.apply_config_changes(self.config_manager.reload())
+
+    def setup_instance_server(self, instance_server: QLocalServer) -> None:
+        self.instance_server = instance_server
+        self.instance_server.setParent(self)
+        self.instance_server.newConnection.connect(self.handle_instance_connection)
+
+    def handle_instance_connection(self) -> None:
+        while self.instance_server.hasPendingConnections():
+            connection = self.instance_server.nextPendingConnection()
+            connection.readyRead.connect(
+                lambda connection=connection: self.read_instance_request(connection)
+            )
+            connection.disconnected.connect(connection.deleteLater)
+
+    def read_instance_request(self, connection: QLocalSocket) -> None:
+        if not connection.canReadLine():
+            return
+        line = bytes(connection.readLine()).decode("utf-8")
+        connection.disconnectFromServer()
+        try:
+            request = json.loads(line)
+        except ValueError:
+            logger.warning(f"Ignoring malformed instance request: {line!r}")
+            return
+        # Defer so modal dialogs don't run inside the socket's signal handler
+        QTimer.singleShot(0, lambda: self.handle_request(request))
+
+    def handle_request(self, request: Dict[str, Any]) -> None:
+        """Carry out a request forwarded by another launch of the app."""
+        action = request.get("action")
+        text = request.get("text", "")
+        if action == "chat":
+            self.show_chat_window()
+        elif action == "search":
+            self.show_search_dialog(text)
+        elif action == "ask":
+            self.show_chat_window()
+            self.chat_window.input_field.setPlainText(text)
+            self.chat_window.handle_send_message()
+        else:
+            logger.warning(f"Unknown instance request: {request}")
+
+    def apply_config_changes(self, changed: Set[str]) -> None:
+        """Reconfigure only the components whose settings changed."""
+        if not changed:
+            return
+        config = self.config_manager.config
+
+        if "database_path" in changed:
+            self.db = DatabaseManager(config.database_path)
+        if changed & {"openai_api_key", "openai_base_url"}:
+            self.api_client.reconfigure(config.openai_api_key, config.openai_base_url)
+        if "model_name" in changed:
+            self.api_client.model = config.model_name
+        if changed & {"auto_fast_model", "auto_strong_model", "database_path"}:
+            self.router.fast_model = config.auto_fast_model
+            self.router.strong_model = config.auto_strong_model
+            self.router.set_db(self.db)
+        self.router.latency_target = config.latency_target_seconds
+        self.apply_hedge_settings(config)
+        self.renderer.db = self.db
+        self.renderer.cache_size = config.render_cache_size
+        self.renderer.persist = config.persist_render_cache
+        if "database_path" in changed:
+            self.outbound.switch_db(self.db)
+        self.outbound.concurrency = max(1, config.queue_concurrency)
+        self.outbound.hard_budget = config.daily_token_hard_budget
+        if changed & {"openai_api_key", "openai_base_url"}:
+            self.outbound.reset_connectivity()
+        self.outbound.wake()
+
+        if self.chat_window:
+            self.chat_window.update_config(config, changed)
+            if "database_path" in changed:
+                self.chat_window.db = self.db
+                self.chat_window.load_contexts()
+                self.chat_window.clear_queue()
+
+    def apply_hedge_settings(self, config: AppConfig) -> None:
+        hedge = self.api_client.hedge
+        hedge.enabled = config.hedge_enabled
+        hedge.percentile = config.hedge_percentile
+        hedge.budget = config.hedge_budget
+        hedge.default_delay = config.hedge_default_delay
+        hedge.hedge_model = config.hedge_model
 
     def get_app_icon(self) -> QIcon:
         icon_path = Path(__file__).parent.parent / "assets" / "icon.png"
@@ -59,14 +230,33 @@ class ToolbarApp(QObject):
 
         # Search action
         search_action = QAction("Search History", self)
-        search_action.triggered.connect(self.show_search_dialog)
+        search_action.triggered.connect(lambda: self.show_search_dialog())
         menu.addAction(search_action)
 
+        # History export/import actions
+        export_action = QAction("Export History...", self)
+        export_action.triggered.connect(self.export_history)
+        menu.addAction(export_action)
+
+        import_action = QAction("Import History...", self)
+        import_action.triggered.connect(self.import_history)
+        menu.addAction(import_action)
+
         # Context Manager action
         context_action = QAction("Manage Contexts", self)
         context_action.triggered.connect(self.show_context_manager)
         menu.addAction(context_action)
 
+        # Usage action
+        usage_action = QAction("Token Usage", self)
+        usage_action.triggered.connect(self.show_usage_dialog)
+        menu.addAction(usage_action)
+
+        # Diagnostics action
+        self.diagnostics_action = QAction("Start Diagnostics", self)
+        self.diagnostics_action.triggered.connect(self.toggle_diagnostics)
+        menu.addAction(self.diagnostics_action)
+
         # Settings action
         settings_action = QAction("Settings", self)
         settings_action.triggered.connect(self.show_settings)
@@ -89,7 +279,7 @@ class ToolbarApp(QObject):
     def show_chat_window(self) -> None:
         if not self.chat_window:
             self.chat_window = ChatWindow(
-                self.api_client, self.db, self.config_manager.config
+                self.outbound, self.db, self.config_manager.config, self.renderer
             )
             self.chat_window.closed.connect(self.handle_chat_window_closed)
 
@@ -100,11 +290,29 @@ class ToolbarApp(QObject):
     def handle_chat_window_closed(self) -> None:
         self.chat_window = None
 
+    def handle_outbound_change(
+        self, item: OutboundItem, message: Optional[ChatMessage]
+    ) -> None:
+        if self.chat_window:
+            self.chat_window.handle_outbound_change(item, message)
+        if item.state in (DONE, FAILED) and (
+            not self.chat_window or item.thread_id != self.chat_window.current_thread_id
+        ):
+            # Queued messages can finish long after their window was closed or
+            # moved on to another thread
+            title = " ".join(item.user_message.split())[:60]
+            if item.state == DONE:
+                self.tray_icon.showMessage("Reply received", title)
+            else:
+                self.tray_icon.showMessage("Message failed", title)
+
     def show_settings(self) -> None:
+        old_config = self.config_manager.config
         dialog = SettingsDialog(self.config_manager, None)
         if dialog.exec() == QDialog.DialogCode.Accepted:
-            # Reload app with new settings
-            self.setup_app()
+            self.apply_config_changes(
+                diff_configs(old_config, self.config_manager.config)
+            )
 
     def show_context_manager(self) -> None:
         dialog = ContextManagerDialog(self.db)
@@ -113,6 +321,79 @@ class ToolbarApp(QObject):
         if self.chat_window:
             self.chat_window.load_contexts()
 
-    def show_search_dialog(self) -> None:
-        dialog = SearchDialog(self.db)
+    def show_usage_dialog(self) -> None:
+        dialog = UsageDialog(self.db)
         dialog.exec()
+
+    def toggle_diagnostics(self) -> None:
+        if diagnostics.is_active():
+            path = self.save_diagnostics()
+            if path:
+                self.tray_icon.showMessage("Diagnostics saved", str(path))
+        else:
+            self.start_diagnostics()
+
+    def start_diagnostics(self) -> None:
+        diagnostics.start()
+        # Started from __init__ before the event loop runs, so watch it later
+        QTimer.singleShot(0, diagnostics.watch_event_loop)
+        self.diagnostics_action.setText("Stop Diagnostics and Save Bundle")
+
+    def save_diagnostics(self) -> Optional[Path]:
+        self.diagnostics_action.setText("Start Diagnostics")
+        try:
+            return diagnostics.stop(vars(self.config_manager.config))
+        except OSError as e:
+            logger.error(f"Failed to write diagnostics bundle: {e}")
+            return None
+
+    def show_search_dialog(self, query: str = "") -> None:
+        dialog = SearchDialog(self.db, query=query)
+        dialog.exec()
+
+    def export_history(self) -> None:
+        default_name = f"chat_history_{datetime.now():%Y%m%d}.jsonl.gz"
+        path, _ = QFileDialog.getSaveFileName(
+            None,
+            "Export History",
+            str(Path.home() / default_name),
+            "Compressed JSON Lines (*.jsonl.gz);;JSON Lines (*.jsonl)",
+        )
+        if path:
+            asyncio.create_task(self._export_history(path))
+
+    async def _export_history(self, path: str) -> None:
+        try:
+            count = await asyncio.to_thread(self.db.export_history, path)
+        except Exception as e:
+            self.tray_icon.showMessage(
+                "Export failed", str(e), QSystemTrayIcon.MessageIcon.Critical
+            )
+            return
+        self.tray_icon.showMessage("Export complete", f"Exported {count} records")
+
+    def import_history(self) -> None:
+        path, _ = QFileDialog.getOpenFileName(
+            None,
+            "Import History",
+            str(Path.home()),
+            "Chat History (*.jsonl *.jsonl.gz);;All Files (*)",
+        )
+        if path:
+            asyncio.create_task(self._import_history(path))
+
+    async def _import_history(self, path: str) -> None:
+        try:
+            result = await asyncio.to_thread(self.db.import_history, path)
+        except Exception as e:
+            self.tray_icon.showMessage(
+                "Import failed", str(e), QSystemTrayIcon.MessageIcon.Critical
+            )
+            return
+        self.tray_icon.showMessage(
+            "Import complete",
+            f"Imported {result.messages} messages and {result.contexts} contexts "
+            f"({result.skipped} duplicates skipped)",
+        )
+        if self.chat_window:
+            self.chat_window.load_contexts()
@@ -0,0 +1,82 @@
+from PyQt6.QtWidgets import (
+    QDialog,
+    QVBoxLayout,
+    QHBoxLayout,
+    QTableWidget,
+    QTableWidgetItem,
+    QLabel,
+    QComboBox,
+)
+from PyQt6.QtCore import Qt
+from datetime import date, timedelta
+
+from db_manager import DatabaseManager
+
+PERIODS = {"Today": 1, "Last 7 Days": 7, "Last 30 Days": 30, "Last Year": 365}
+
+
+class UsageDialog(QDialog):
+    def __init__(self, db: DatabaseManager, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.setup_ui()
+        self.load_usage()
+
+    def setup_ui(self) -> None:
+        self.setWindowTitle("Token Usage")
+        self.setMinimumSize(700, 400)
+
+        layout = QVBoxLayout(self)
+
+        period_layout = QHBoxLayout()
+        self.period_combo = QComboBox()
+        self.period_combo.addItems(PERIODS)
+        self.period_combo.setCurrentText("Last 30 Days")
+        self.period_combo.currentTextChanged.connect(self.load_usage)
+        period_layout.addWidget(QLabel("Period:"))
+        period_layout.addWidget(self.period_combo)
+        period_layout.addStretch()
+        layout.addLayout(period_layout)
+
+        self.usage_table = QTableWidget()
+        self.usage_table.setColumnCount(7)
+        self.usage_table.setHorizontalHeaderLabels(
+            ["Model", "Context", "Requests", "Prompt", "Completion", "Cached", "Total"]
+        )
+        self.usage_table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.usage_table)
+
+        self.total_label = QLabel()
+        layout.addWidget(self.total_label)
+
+    def load_usage(self) -> None:
+        end = date.today()
+        start = end - timedelta(days=PERIODS[self.period_combo.currentText()] - 1)
+        rows = self.db.get_usage_report(start.isoformat(), end.isoformat())
+
+        self.usage_table.setRowCount(0)
+        for usage in rows:
+            row = self.usage_table.rowCount()
+            self.usage_table.insertRow(row)
+            values = [
+                usage.model or "-",
+                usage.context_name or "No Context",
+                usage.requests,
+                usage.prompt_tokens,
+                usage.completion_tokens,
+                usage.cached_tokens,
+                usage.total_tokens,
+            ]
+            for column, value in enumerate(values):
+                if isinstance(value, int):
+                    item = QTableWidgetItem(f"{value:,}")
+                    item.setTextAlignment(
+                        Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter
+                    )
+                else:
+                    item = QTableWidgetItem(value)
+                self.usage_table.setItem(row, column, item)
+
+        total = sum(usage.total_tokens for usage in rows)
+        today = self.db.get_daily_token_total(end.isoformat())
+        self.total_label.setText(f"Total: {total:,} tokens  |  Today: {today:,} tokens")
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The app runs from src/ with its modules imported top-level
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
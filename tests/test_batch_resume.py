@@ -0,0 +1,107 @@
+"""Run BatchRunner against a local OpenAI-compatible stub, interrupt it and resume."""
+
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from batch import BatchRunner
+from db_manager import DatabaseManager
+from openai_client import OpenAIWrapper
+
+PROMPTS = [f"prompt {i}" for i in range(20)]
+RESPONSE_DELAY = 0.05
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = body["messages"][-1]["content"]
+        time.sleep(RESPONSE_DELAY)
+        self.server.requests.append(prompt)
+        payload = json.dumps(
+            {
+                "id": "stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": body["model"],
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": f"re: {prompt}"},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 5,
+                    "completion_tokens": 3,
+                    "total_tokens": 8,
+                },
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+@pytest.fixture
+def stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1", server.requests
+    server.shutdown()
+    server.server_close()
+
+
+async def run_until_interrupted(runner: BatchRunner, requests: list) -> None:
+    task = asyncio.create_task(runner.run(PROMPTS, "resume-test"))
+    while len(requests) < len(PROMPTS) // 3:
+        await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+def test_interrupted_batch_resumes_without_duplicates(tmp_path, stub_url):
+    base_url, requests = stub_url
+    db = DatabaseManager(str(tmp_path / "chat_history.db"))
+    api_client = OpenAIWrapper("test-key", "stub-model", base_url)
+
+    first = BatchRunner(api_client, db, concurrency=4, flush_size=1)
+    asyncio.run(run_until_interrupted(first, requests))
+    persisted = len(db.get_completed_batch_items("resume-test"))
+    assert 0 < persisted < len(PROMPTS)
+    with db.get_connection() as conn:
+        done = {
+            row[0] for row in conn.execute("SELECT user_message FROM chat_messages")
+        }
+
+    sent_before = len(requests)
+    second = BatchRunner(api_client, db, concurrency=4, flush_size=1)
+    progress = asyncio.run(second.run(PROMPTS, "resume-test"))
+
+    assert not done & set(requests[sent_before:])
+
+    assert progress.skipped == persisted
+    assert progress.completed == len(PROMPTS) - persisted
+    assert progress.failed == 0
+    with db.get_connection() as conn:
+        rows = conn.execute(
+            "SELECT user_message, assistant_message FROM chat_messages"
+        ).fetchall()
+    assert sorted(row["user_message"] for row in rows) == sorted(PROMPTS)
+    assert all(row["assistant_message"] == f"re: {row['user_message']}" for row in rows)
+    assert len(db.get_completed_batch_items("resume-test")) == len(PROMPTS)
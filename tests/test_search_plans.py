@@ -0,0 +1,113 @@
+"""Check that filtered searches read chat_messages through the timestamp indexes.
+
+A plan that sorts with a temp b-tree has to read every matching row before it
+can return the first page, which is what made searches slow on large histories.
+"""
+
+from datetime import datetime, timedelta
+from typing import List
+
+import pytest
+
+from db_manager import _SEARCH_SQL, NO_CONTEXT, ChatMessage, Context, DatabaseManager
+
+MESSAGES = 2000
+THREADS = 40
+
+
+@pytest.fixture(scope="module")
+def db(tmp_path_factory) -> DatabaseManager:
+    db = DatabaseManager(str(tmp_path_factory.mktemp("search") / "chat_history.db"))
+    now = datetime(2024, 6, 1)
+    context_ids = [
+        db.add_context(Context(None, f"context {i}", f"content {i}", now, now))
+        for i in range(3)
+    ]
+    for i in range(MESSAGES):
+        context_id = context_ids[i % 4] if i % 4 < 3 else None
+        db.add_message(
+            ChatMessage(
+                id=None,
+                user_message=f"question {i}",
+                assistant_message=f"answer {i}",
+                context_id=context_id,
+                timestamp=now - timedelta(hours=i),
+                thread_id=float(i % THREADS),
+            ),
+            context_content=f"content {context_ids.index(context_id)}"
+            if context_id
+            else None,
+        )
+    return db
+
+
+def query_plan(db: DatabaseManager, query: str = "", **filters) -> List[str]:
+    where, params = db._search_filter(query, "All", **filters)
+    with db.get_connection() as conn:
+        rows = conn.execute(
+            "EXPLAIN QUERY PLAN " + _SEARCH_SQL.format(where=where), (*params, 50)
+        ).fetchall()
+    return [row["detail"] for row in rows]
+
+
+def assert_uses_index(plan: List[str], index: str) -> None:
+    # chat_messages is aliased as m in the search query
+    messages_steps = [
+        step for step in plan if step.split()[:2] in (["SCAN", "m"], ["SEARCH", "m"])
+    ]
+    assert any(
+        f"INDEX {index} " in f"{step} " for step in messages_steps
+    ), f"{index} not used: {plan}"
+    assert not any("USE TEMP B-TREE FOR ORDER BY" in step for step in plan), plan
+
+
+def test_context_filter_uses_context_index(db):
+    context_id = db.get_contexts()[0].id
+    assert_uses_index(
+        query_plan(db, context_id=context_id), "idx_chat_context_timestamp"
+    )
+
+
+def test_no_context_filter_uses_context_index(db):
+    assert_uses_index(
+        query_plan(db, "answer", context_id=NO_CONTEXT), "idx_chat_context_timestamp"
+    )
+
+
+def test_context_and_date_filter_uses_context_index(db):
+    context_id = db.get_contexts()[0].id
+    assert_uses_index(
+        query_plan(
+            db,
+            start=datetime(2024, 3, 1),
+            end=datetime(2024, 4, 1),
+            context_id=context_id,
+        ),
+        "idx_chat_context_timestamp",
+    )
+
+
+def test_thread_filter_uses_thread_index(db):
+    assert_uses_index(
+        query_plan(db, "question", thread_id=3.0), "idx_chat_thread_timestamp"
+    )
+
+
+def test_date_filter_uses_timestamp_index(db):
+    assert_uses_index(
+        query_plan(db, start=datetime(2024, 3, 1), end=datetime(2024, 4, 1)),
+        "idx_chat_timestamp",
+    )
+
+
+def test_unfiltered_search_uses_timestamp_index(db):
+    assert_uses_index(query_plan(db, "answer"), "idx_chat_timestamp")
+
+
+def test_plans_return_newest_first(db):
+    context_id = db.get_contexts()[1].id
+    messages = db.search_messages("", context_id=context_id, limit=20)
+    assert len(messages) == 20
+    assert all(m.context_id == context_id for m in messages)
+    timestamps = [m.timestamp for m in messages]
+    assert timestamps == sorted(timestamps, reverse=True)